@@ -0,0 +1,640 @@
+import asyncio
+import errno
+import socket
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+
+import judge
+from metrics import metrics
+
+MAX_HEADER_BYTES = 16384
+
+# Order in which detect() tries the protocols on one endpoint, after the
+# ones it is listed under
+DETECT_ORDER = ['socks5', 'socks4', 'http']
+# Ceiling in seconds for probing an endpoint with a protocol it is not
+# listed under. A plain HTTP proxy sits on a SOCKS greeting until the
+# timeout, so classifying with the full one costs more than it finds.
+# Once a full probe has shown how quick the endpoint is, the other
+# handshakes get CLASSIFY_SLACK times that, but at least
+# CLASSIFY_MIN_TIMEOUT.
+CLASSIFY_TIMEOUT = 2
+CLASSIFY_MIN_TIMEOUT = 0.5
+CLASSIFY_SLACK = 2
+
+# Timings are seconds since the probe started: `connect` when the TCP
+# connection to the proxy was up, `ttfb` when the judge's response headers
+# arrived, `elapsed` when the probe finished. `exit_ip` is the address the
+# judge saw the request coming from.
+ProbeResult = namedtuple('ProbeResult',
+                         ['proxy', 'protocol', 'ok', 'elapsed', 'error', 'connect', 'ttfb',
+                          'exit_ip'],
+                         defaults=(None, None, None))
+
+
+# Errors that say nothing about the proxy itself: 'local' means this host
+# ran out of sockets, 'judge' that the judges failed (rate limits, errors
+# through a working tunnel, none resolvable). Such results leave the proxy
+# undecided, so they are kept out of the history, the journal and the
+# pool's eviction.
+UNDECIDED_ERRORS = ('local', 'judge')
+
+# A probe that fails for lack of local sockets is retried after
+# LOCAL_RETRY_DELAY seconds, doubling, up to LOCAL_RETRIES times
+LOCAL_RETRIES = 3
+LOCAL_RETRY_DELAY = 0.5
+
+
+def is_decided(result):
+    return result.ok or result.error not in UNDECIDED_ERRORS
+
+
+class ProbeError(Exception):
+    def __init__(self, kind, message=''):
+        super().__init__(message or kind)
+        self.kind = kind
+
+
+def split_proxy(proxy):
+    host, _, port = proxy.rpartition(':')
+    return host, int(port)
+
+
+async def read_http_head(reader):
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError:
+        raise ProbeError('handshake', 'connection closed before headers')
+    except asyncio.LimitOverrunError:
+        raise ProbeError('handshake', 'oversized headers')
+    return head
+
+
+def http_status(head):
+    try:
+        return int(head.split(b'\r\n', 1)[0].split(b' ', 2)[1])
+    except (IndexError, ValueError):
+        raise ProbeError('handshake', 'malformed status line')
+
+
+async def handshake_http(reader, writer, host, port):
+    target = f"{host}:{port}".encode()
+    writer.write(b'CONNECT ' + target + b' HTTP/1.1\r\nHost: ' + target + b'\r\n\r\n')
+    await writer.drain()
+    status = http_status(await read_http_head(reader))
+    if status != 200:
+        raise ProbeError('handshake', f'CONNECT returned {status}')
+
+
+async def handshake_socks4(reader, writer, ip, port):
+    writer.write(struct.pack('>BBH', 4, 1, port) + socket.inet_aton(ip) + b'\x00')
+    await writer.drain()
+    try:
+        reply = await reader.readexactly(8)
+    except asyncio.IncompleteReadError:
+        raise ProbeError('handshake', 'short SOCKS4 reply')
+    if reply[1] != 0x5A:
+        raise ProbeError('handshake', f'SOCKS4 rejected ({reply[1]:#x})')
+
+
+async def handshake_socks5(reader, writer, host, port):
+    writer.write(b'\x05\x01\x00')
+    await writer.drain()
+    try:
+        method = await reader.readexactly(2)
+        if method != b'\x05\x00':
+            raise ProbeError('handshake', 'SOCKS5 no acceptable auth method')
+
+        name = host.encode()
+        writer.write(b'\x05\x01\x00\x03' + bytes([len(name)]) + name + struct.pack('>H', port))
+        await writer.drain()
+
+        reply = await reader.readexactly(4)
+        if reply[1] != 0x00:
+            raise ProbeError('handshake', f'SOCKS5 rejected ({reply[1]:#x})')
+        atyp = reply[3]
+        if atyp == 0x01:
+            await reader.readexactly(4 + 2)
+        elif atyp == 0x04:
+            await reader.readexactly(16 + 2)
+        elif atyp == 0x03:
+            length = (await reader.readexactly(1))[0]
+            await reader.readexactly(length + 2)
+        else:
+            raise ProbeError('handshake', 'SOCKS5 bad address type')
+    except asyncio.IncompleteReadError:
+        raise ProbeError('handshake', 'short SOCKS5 reply')
+
+
+def header_value(head, wanted):
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == wanted:
+            return value.strip()
+    return None
+
+
+def content_length(head):
+    try:
+        return int(header_value(head, b'content-length'))
+    except (TypeError, ValueError):
+        return None
+
+
+def dechunk(body):
+    """Payload of a (possibly truncated) chunked body."""
+    payload = b''
+    while body:
+        size_line, sep, body = body.partition(b'\r\n')
+        try:
+            size = int(size_line.split(b';')[0], 16)
+        except ValueError:
+            break
+        if not sep or size == 0:
+            break
+        payload += body[:size]
+        body = body[size + 2:]
+    return payload
+
+
+async def read_http_body(reader, head):
+    """Reads up to judge.MAX_BODY_BYTES of the body that follows `head`."""
+    length = content_length(head)
+    limit = judge.MAX_BODY_BYTES if length is None else min(length, judge.MAX_BODY_BYTES)
+    body = b''
+    while len(body) < limit:
+        chunk = await reader.read(limit - len(body))
+        if not chunk:
+            break
+        body += chunk
+    if (header_value(head, b'transfer-encoding') or b'').lower() == b'chunked':
+        return dechunk(body)
+    return body
+
+
+async def request_judge(reader, writer, target_judge, timings, forward=False):
+    """
+    GETs the judge and returns the exit IP it reports. In `forward` mode the
+    absolute URI is sent to an HTTP proxy; otherwise the request goes
+    through an established tunnel, so any non-200 comes from the judge.
+    Only a body the judge could have sent counts: in forward mode any web
+    server answering 200 to an absolute URI would otherwise pass as a proxy.
+    """
+    target = target_judge.url if forward else target_judge.path
+    writer.write(
+        f"GET {target} HTTP/1.1\r\nHost: {target_judge.host_header}\r\n"
+        f"Connection: close\r\n\r\n".encode()
+    )
+    await writer.drain()
+    head = await read_http_head(reader)
+    status = http_status(head)
+    if status != 200:
+        if not forward or status in judge.JUDGE_FAULT_STATUSES:
+            raise ProbeError('judge', f'judge returned {status}')
+        raise ProbeError('status', f'proxy returned {status}')
+    timings.setdefault('ttfb', time.monotonic())
+    try:
+        exit_ip = judge.parse_exit_ip(await read_http_body(reader, head))
+    except (ConnectionError, OSError):
+        exit_ip = None
+    if exit_ip is None:
+        raise ProbeError('status' if forward else 'judge', 'not a judge response')
+    return exit_ip
+
+
+class AdaptiveTimeout:
+    """
+    Probe timeout that follows the latency of successful checks: once
+    `warmup` successes are known it is `multiplier` x their p95, clamped to
+    [minimum, ceiling]. Until then the configured ceiling applies. Safe to
+    share between threads.
+    """
+
+    def __init__(self, ceiling, multiplier=3, minimum=2, warmup=20, window=500):
+        self.ceiling = ceiling
+        self.multiplier = multiplier
+        self.minimum = minimum
+        self.warmup = warmup
+        self.samples = deque(maxlen=window)
+        self.value = ceiling
+        self.pending = 0
+
+    def observe(self, result):
+        if not result.ok:
+            return
+        self.samples.append(result.elapsed)
+        self.pending += 1
+        # Re-sorting the window on every success would dominate fast runs
+        if len(self.samples) >= self.warmup and self.pending >= max(self.warmup // 2, 1):
+            self.pending = 0
+            ordered = sorted(self.samples)
+            p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+            self.value = min(max(p95 * self.multiplier, self.minimum), self.ceiling)
+
+    def current(self):
+        return self.value
+
+
+class AsyncLivenessChecker:
+    """
+    Checks proxies with raw asyncio sockets instead of one blocking
+    requests.get per thread. Each probe opens the proxy connection, performs
+    the HTTP CONNECT / SOCKS4 / SOCKS5 handshake towards a judge from
+    `judges` (plain http:// URLs, default judge.DEFAULT_JUDGES) and expects
+    a 200 for a plain GET sent through the tunnel. With `adaptive` the
+    per-probe timeout shrinks towards the observed p95 latency.
+    """
+
+    def __init__(self, timeout=10, concurrency=1000, adaptive=True, judges=None):
+        self.timeout = timeout
+        self.adaptive_timeout = AdaptiveTimeout(timeout) if adaptive else None
+        self.concurrency = concurrency
+        # Judge defaults are read at construction so they can be repointed
+        # module-wide (e.g. at a local judge by the benchmark)
+        urls = [url for url in (judges or judge.DEFAULT_JUDGES) if url.startswith('http://')]
+        if not urls:
+            raise ValueError("the async engine needs at least one http:// judge")
+        self.judges = judge.JudgePool(urls)
+        self.stream_tasks = []
+
+    async def _connect(self, host, port):
+        try:
+            return await asyncio.open_connection(host, port, limit=MAX_HEADER_BYTES)
+        except ConnectionRefusedError:
+            raise ProbeError('refused')
+        except TimeoutError:
+            raise ProbeError('timeout')
+        except OSError as e:
+            if e.errno in (errno.EMFILE, errno.ENFILE):
+                raise ProbeError('local', str(e))
+            raise ProbeError('unreachable', str(e))
+
+    async def _probe_http_connect(self, host, port, target, timings, handshake_only=False):
+        reader, writer = await self._connect(host, port)
+        timings.setdefault('connect', time.monotonic())
+        try:
+            await handshake_http(reader, writer, target.host, target.port)
+            if handshake_only:
+                return None
+            return await request_judge(reader, writer, target, timings)
+        except (ConnectionError, OSError) as e:
+            raise ProbeError('reset', str(e))
+        finally:
+            writer.close()
+
+    async def _probe_http_forward(self, host, port, target, timings):
+        # Many HTTP proxies refuse CONNECT to port 80 but still forward
+        # absolute-URI requests, which is what requests does for http:// URLs.
+        reader, writer = await self._connect(host, port)
+        timings.setdefault('connect', time.monotonic())
+        try:
+            return await request_judge(reader, writer, target, timings, forward=True)
+        except (ConnectionError, OSError) as e:
+            raise ProbeError('reset', str(e))
+        finally:
+            writer.close()
+
+    async def _probe_http(self, host, port, target, timings):
+        """Races CONNECT and forward mode; the first one to succeed wins."""
+        attempts = [asyncio.ensure_future(self._probe_http_connect(host, port, target, timings)),
+                    asyncio.ensure_future(self._probe_http_forward(host, port, target, timings))]
+        error = None
+        try:
+            for attempt in asyncio.as_completed(attempts):
+                try:
+                    return await attempt
+                except ProbeError as e:
+                    # Report the most informative failure: a proxy that was
+                    # reachable but failed the handshake beats 'refused',
+                    # which still beats running out of local sockets
+                    if error is None or error.kind == 'local' or e.kind not in ('refused', 'local'):
+                        error = e
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+    async def _probe_via(self, proxy, protocol, target, timings, handshake_only=False):
+        """
+        Tunnels to `target` and GETs it. With `handshake_only` the probe
+        ends once the proxy has reported the tunnel to the judge as open,
+        except for HTTP proxies that only work in forward mode, which have
+        no handshake and need the GET.
+        """
+        host, port = split_proxy(proxy)
+        if protocol == 'http' and handshake_only:
+            try:
+                return await self._probe_http_connect(host, port, target, timings, True)
+            except ProbeError as e:
+                if e.kind != 'handshake':
+                    raise
+                return await self._probe_http_forward(host, port, target, timings)
+        if protocol == 'http':
+            return await self._probe_http(host, port, target, timings)
+
+        reader, writer = await self._connect(host, port)
+        timings['connect'] = time.monotonic()
+
+        try:
+            if protocol == 'socks4':
+                # SOCKS4 (without the 4a extension) can only address IPv4 literals
+                await handshake_socks4(reader, writer, target.ip, target.port)
+            elif protocol == 'socks5':
+                await handshake_socks5(reader, writer, target.host, target.port)
+            else:
+                raise ProbeError('error', f'unknown protocol {protocol}')
+            if handshake_only:
+                return None
+            return await request_judge(reader, writer, target, timings)
+        except (ConnectionError, OSError) as e:
+            raise ProbeError('reset', str(e))
+        finally:
+            writer.close()
+
+    async def _probe(self, proxy, protocol, timings, handshake_only=False):
+        """
+        Probes through a judge from the pool; if that judge fails on its own
+        account the probe is retried once through another judge.
+        """
+        tried = None
+        for _ in range(2):
+            target = self.judges.acquire(exclude=tried, need_ip=protocol == 'socks4')
+            if target is None:
+                break
+            fault = None
+            try:
+                exit_ip = await self._probe_via(proxy, protocol, target, timings, handshake_only)
+                # A bare handshake says nothing about the judge itself
+                fault = None if handshake_only and 'ttfb' not in timings else False
+                return exit_ip
+            except ProbeError as e:
+                if e.kind != 'judge':
+                    raise
+                fault = True
+                tried = target
+            finally:
+                self.judges.release(target, fault)
+        if tried is None:
+            raise ProbeError('judge', 'no judge available')
+        raise ProbeError('judge', f'{tried.host_header} failed')
+
+    def current_timeout(self):
+        return self.adaptive_timeout.current() if self.adaptive_timeout else self.timeout
+
+    async def probe(self, proxy, protocol, handshake_only=False, timeout=None):
+        for attempt in range(LOCAL_RETRIES + 1):
+            result = await self._timed_probe(proxy, protocol, handshake_only, timeout)
+            if result.error != 'local' or attempt == LOCAL_RETRIES:
+                return result
+            await asyncio.sleep(LOCAL_RETRY_DELAY * 2 ** attempt)
+
+    async def _timed_probe(self, proxy, protocol, handshake_only=False, timeout=None):
+        start = time.monotonic()
+        timings = {}
+        error = None
+        exit_ip = None
+        try:
+            with metrics.in_flight():
+                exit_ip = await asyncio.wait_for(
+                    self._probe(proxy, protocol, timings, handshake_only),
+                    timeout or self.current_timeout())
+        except asyncio.TimeoutError:
+            error = 'timeout'
+        except ProbeError as e:
+            error = e.kind
+        except ValueError:
+            error = 'invalid'
+        end = time.monotonic()
+        connect = timings['connect'] - start if 'connect' in timings else None
+        ttfb = timings['ttfb'] - start if 'ttfb' in timings else None
+        result = ProbeResult(proxy, protocol, error is None, end - start, error, connect, ttfb,
+                             exit_ip)
+        # Bare handshakes are quicker than full probes and would drag it down
+        if self.adaptive_timeout and not handshake_only:
+            self.adaptive_timeout.observe(result)
+        return result
+
+    async def detect(self, proxy, listed=()):
+        """
+        Finds out which protocols an endpoint speaks, whatever list it came
+        from, each on a fresh connection towards a judge. The first protocol
+        it is `listed` under (else the first of DETECT_ORDER) gets a full
+        probe. An endpoint that does not even accept a TCP connection is
+        given up on after that. The remaining protocols are then tried at
+        the same time: only their handshake once a protocol has confirmed
+        that the endpoint relays traffic, a full probe otherwise. Protocols
+        the endpoint is not listed under get at most CLASSIFY_TIMEOUT.
+        Returns a ProbeResult per protocol in DETECT_ORDER.
+        """
+        order = [p for p in DETECT_ORDER if p in listed] + [p for p in DETECT_ORDER if p not in listed]
+        first = await self.probe(proxy, order[0],
+                                 timeout=None if order[0] in listed else self.classify_timeout())
+        classify_timeout = self.classify_timeout(first.elapsed if first.ok else None)
+        if (not first.ok and first.connect is None
+                and first.error in ('refused', 'unreachable', 'timeout', 'invalid')):
+            # Not even TCP: the other protocols cannot fare better
+            return [first._replace(protocol=protocol) for protocol in DETECT_ORDER]
+
+        rest = await asyncio.gather(*(
+            self.probe(proxy, protocol, handshake_only=first.ok,
+                       timeout=None if protocol in listed else classify_timeout)
+            for protocol in order[1:]))
+        by_protocol = {r.protocol: r for r in [first, *rest]}
+        return [by_protocol[protocol] for protocol in DETECT_ORDER]
+
+    def classify_timeout(self, measured=None):
+        ceiling = min(self.current_timeout(), CLASSIFY_TIMEOUT)
+        if measured is None:
+            return ceiling
+        return min(max(measured * CLASSIFY_SLACK, CLASSIFY_MIN_TIMEOUT), ceiling)
+
+    async def detect_all(self, proxies, on_result=None, deadline=None, listed=None):
+        """
+        detect() for every endpoint with at most `concurrency` in flight;
+        `listed` maps endpoints to the protocols they are listed under.
+        """
+        listed = listed or {}
+        await self.judges.resolve()
+        queue = asyncio.Queue()
+        for proxy in proxies:
+            queue.put_nowait(proxy)
+
+        results = []
+        decided = 0
+
+        async def worker():
+            nonlocal decided
+            while True:
+                try:
+                    proxy = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                for result in await self.detect(proxy, listed.get(proxy, ())):
+                    results.append(result)
+                    if on_result:
+                        on_result(result)
+                decided += 1
+
+        finished = await self.run_workers(worker, min(self.concurrency, len(proxies)), deadline)
+        if not finished:
+            print(f"  Detection deadline of {deadline}s reached, "
+                  f"{len(proxies) - decided} endpoints left undecided")
+        print(f"  Judges: {self.judges.summary()}")
+        return results
+
+    async def run_workers(self, worker, count, deadline=None):
+        """
+        Runs `count` copies of `worker` until they finish or `deadline`
+        seconds pass; on expiry the outstanding probes are cancelled.
+        Returns False if the deadline cut the run short.
+        """
+        tasks = [asyncio.ensure_future(worker()) for _ in range(count)]
+        if not tasks:
+            return True
+        _, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return not pending
+
+    async def check(self, proxies, protocol, on_result=None, deadline=None):
+        """
+        Probes every proxy with at most `concurrency` probes in flight. With
+        a `deadline`, returns the results gathered until then.
+        """
+        if protocol == 'socks4':
+            await self.judges.resolve()
+
+        queue = asyncio.Queue()
+        for proxy in proxies:
+            queue.put_nowait(proxy)
+
+        results = []
+
+        async def worker():
+            while True:
+                try:
+                    proxy = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await self.probe(proxy, protocol)
+                results.append(result)
+                if on_result:
+                    on_result(result)
+
+        finished = await self.run_workers(worker, min(self.concurrency, len(proxies)), deadline)
+        if not finished:
+            print(f"  {protocol} phase deadline of {deadline}s reached, "
+                  f"{len(proxies) - len(results)} proxies left undecided")
+        print(f"  Judges: {self.judges.summary()}")
+        return results
+
+    async def check_stream(self, queue, on_result=None):
+        """
+        Probes (proxy, protocol) items taken from `queue` as they arrive until
+        each worker receives a None sentinel, or until cancel() is called.
+        """
+        await self.judges.resolve()
+
+        results = []
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                result = await self.probe(*item)
+                results.append(result)
+                if on_result:
+                    on_result(result)
+
+        self.stream_tasks = [asyncio.ensure_future(worker()) for _ in range(self.concurrency)]
+        await asyncio.gather(*self.stream_tasks, return_exceptions=True)
+        print(f"  Judges: {self.judges.summary()}")
+        return results
+
+    def cancel(self):
+        """Cancels a running check_stream(); must be called on its loop."""
+        for task in self.stream_tasks:
+            task.cancel()
+
+
+class BackgroundChecker:
+    """
+    Runs AsyncLivenessChecker.check_stream() on its own event loop thread so
+    that fetch threads can hand over endpoints with submit() while they are
+    still downloading.
+    """
+
+    def __init__(self, checker, on_result=None):
+        self.checker = checker
+        self.on_result = on_result
+        self.loop = None
+        self.queue = None
+        self.results = []
+        self.error = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='liveness-checker', daemon=True)
+
+    def _run(self):
+        async def main():
+            self.loop = asyncio.get_running_loop()
+            self.queue = asyncio.Queue()
+            self.ready.set()
+            return await self.checker.check_stream(self.queue, self.on_result)
+        try:
+            self.results = asyncio.run(main())
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def submit(self, proxy, protocol):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (proxy, protocol))
+        except RuntimeError:
+            # Loop already gone; finish() reports why
+            pass
+
+    def finish(self, deadline=None):
+        """
+        Lets the queued probes drain, then returns every ProbeResult. After
+        `deadline` seconds the outstanding probes are cancelled and the
+        results so far are returned.
+        """
+        if self.thread.is_alive():
+            for _ in range(self.checker.concurrency):
+                self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+            self.thread.join(deadline)
+            if self.thread.is_alive():
+                print(f"  Check deadline of {deadline}s reached, cancelling outstanding probes")
+                self.loop.call_soon_threadsafe(self.checker.cancel)
+                self.thread.join()
+        if self.error:
+            raise self.error
+        return self.results
+
+
+def detect_protocols(proxies, timeout=10, concurrency=1000, on_result=None,
+                     adaptive=True, deadline=None, judges=None, listed=None):
+    """Synchronous entry point: ProbeResults for every protocol of every endpoint."""
+    checker = AsyncLivenessChecker(timeout=timeout, concurrency=concurrency, adaptive=adaptive,
+                                   judges=judges)
+    return asyncio.run(checker.detect_all(proxies, on_result=on_result, deadline=deadline,
+                                          listed=listed))
+
+
+def check_proxies(proxies, protocol, timeout=10, concurrency=1000, on_result=None,
+                  adaptive=True, deadline=None, judges=None):
+    """Synchronous entry point: returns a list of ProbeResult for `proxies`."""
+    checker = AsyncLivenessChecker(timeout=timeout, concurrency=concurrency, adaptive=adaptive,
+                                   judges=judges)
+    return asyncio.run(checker.check(proxies, protocol, on_result=on_result, deadline=deadline))
@@ -0,0 +1,242 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import fake_proxies
+
+# Offline checker benchmark: every engine run happens in a fresh child
+# process against a local FakeProxyFarm, so peak RSS and open file
+# descriptors are those of the checker alone.
+SCALES = [1000, 10000, 100000]
+PROTOCOLS = ['http', 'socks4', 'socks5']
+
+
+def point_judges_at(ports):
+    import judge
+    judge.DEFAULT_JUDGES = [f"http://127.0.0.1:{ports['judge']}/ip"]
+
+
+def run_async(by_proto, options):
+    import async_checker
+    results = []
+    for proto, proxies in by_proto.items():
+        results += async_checker.check_proxies(proxies, proto, timeout=options['timeout'],
+                                               concurrency=options['concurrency'])
+    return results
+
+
+def threads_deadline(count, options):
+    """
+    Seconds a threads run over `count` endpoints may take: every wave of
+    probes through all its judge attempts, plus one timeout of slack.
+    requests' timeout only bounds each read, so a slowloris proxy trickling
+    bytes would otherwise hold its worker, and the run, forever.
+    """
+    import proxy_manager
+    waves = -(-count // options['concurrency'])
+    return (waves * proxy_manager.JUDGE_ATTEMPTS + 1) * options['timeout']
+
+
+def run_threads(by_proto, options):
+    # SOCKS through requests needs PySocks (requests[socks]) installed
+    import proxy_manager
+    results = []
+    for proto, proxies in by_proto.items():
+        results += proxy_manager.check_with_threads(proxies, proto, options['timeout'],
+                                                    options['concurrency'],
+                                                    deadline=threads_deadline(len(proxies), options))
+    return results
+
+
+def run_manager(by_proto, options):
+    """The full check_proxies_liveness() path, pre-filter included, in a scratch tree."""
+    import proxy_manager
+    with tempfile.TemporaryDirectory() as base:
+        proxy_manager.BASE_DIR = base
+        proxy_manager.CLEAN_DIR = os.path.join(base, 'clean')
+        proxy_manager.ACTIVE_DIR = os.path.join(base, 'active')
+        proxy_manager.FASTEST_DIR = os.path.join(base, 'fastest')
+        os.makedirs(proxy_manager.CLEAN_DIR)
+        for proto, proxies in by_proto.items():
+            with open(os.path.join(proxy_manager.CLEAN_DIR, f"{proto}.txt"), 'w') as f:
+                f.write('\n'.join(proxies) + '\n')
+        results = proxy_manager.check_proxies_liveness(
+            engine='async', timeout=options['timeout'], concurrency=options['concurrency'],
+            prefilter_timeout=options['prefilter_timeout'], history_path=None, fastest=0)
+    return [r for proto_results in results.values() for r in proto_results]
+
+
+def run_detect(by_proto, options):
+    """proxy_manager.detect_endpoints(): one cross-protocol probe per endpoint."""
+    import proxy_manager
+    outcomes = proxy_manager.detect_endpoints(
+        by_proto, options['timeout'], options['concurrency'],
+        prefilter_timeout=options['prefilter_timeout'])
+    return [r for results, dropped in outcomes.values() for r in results + dropped]
+
+
+# Engines the harness can drive; a replacement checker only needs an entry
+# taking ({protocol: [endpoint, ...]}, options) and returning ProbeResults.
+ENGINES = {
+    'async': run_async,
+    'threads': run_threads,
+    'manager': run_manager,
+    'detect': run_detect,
+}
+
+
+class FdSampler(threading.Thread):
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, len(os.listdir('/proc/self/fd')))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def run_child(config):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    point_judges_at(config['ports'])
+
+    count = config['count']
+    by_proto, expected = {}, {}
+    for i, proto in enumerate(PROTOCOLS):
+        share = count // len(PROTOCOLS) + (1 if i < count % len(PROTOCOLS) else 0)
+        entries = fake_proxies.endpoints(config['ports'], proto, share, config['mix'], config['seed'])
+        by_proto[proto] = [endpoint for endpoint, _ in entries]
+        expected.update({(proto, endpoint): behaviour == 'ok' for endpoint, behaviour in entries})
+
+    sampler = FdSampler()
+    sampler.start()
+    start = time.monotonic()
+    results = ENGINES[config['engine']](by_proto, config)
+    elapsed = time.monotonic() - start
+    peak_fds = sampler.stop()
+
+    import async_checker
+    probe_times = [r.elapsed for r in results if r.elapsed is not None]
+    decided = {(r.protocol, r.proxy) for r in results if async_checker.is_decided(r)}
+    working = sum(1 for r in results if r.ok)
+    # Protocol detection may also report endpoints under protocols they were not listed for
+    false_negatives = sum(1 for r in results if not r.ok and expected.get((r.protocol, r.proxy)))
+    false_positives = sum(1 for r in results if r.ok and not expected.get((r.protocol, r.proxy)))
+    return {
+        'engine': config['engine'],
+        'endpoints': count,
+        'seconds': round(elapsed, 2),
+        'checks_per_sec': round(len(results) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(probe_times, 0.50) * 1000, 1) if probe_times else None,
+        'p99_ms': round(percentile(probe_times, 0.99) * 1000, 1) if probe_times else None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_fds': peak_fds,
+        'working': working,
+        'expected_working': sum(expected.values()),
+        'false_negatives': false_negatives,
+        'false_positives': false_positives,
+        # Listed endpoints a deadline left unchecked or a probe could not decide
+        'undecided': sum(1 for key in expected if key not in decided),
+    }
+
+
+def print_table(rows):
+    columns = ['engine', 'endpoints', 'seconds', 'checks_per_sec', 'p50_ms', 'p99_ms',
+               'peak_rss_mb', 'peak_fds', 'working', 'expected_working',
+               'false_negatives', 'false_positives', 'undecided']
+    widths = {c: max(len(c), *(len(str(r.get(c))) for r in rows)) for c in columns}
+    print('  '.join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print('  '.join(str(row.get(c)).rjust(widths[c]) for c in columns))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark liveness engines against local fake proxies.")
+    parser.add_argument('--engines', default='async,manager',
+                        help=f"comma-separated engines out of {sorted(ENGINES)} (default: async,manager)")
+    parser.add_argument('--scales', default=','.join(map(str, SCALES)),
+                        help="comma-separated endpoint counts (default: 1000,10000,100000)")
+    parser.add_argument('--mix', type=fake_proxies.parse_mix,
+                        help="behaviour shares, e.g. ok=0.1,refused=0.5,blackhole=0.2,drop=0.1,slowloris=0.1")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="seconds each fake proxy waits before its handshake reply (default: 0.05)")
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help="share of connections to working fake proxies that are dropped (default: 0)")
+    parser.add_argument('--timeout', type=float, default=3,
+                        help="probe timeout given to the engines (default: 3)")
+    parser.add_argument('--prefilter-timeout', type=float, default=1,
+                        help="TCP pre-filter timeout for the manager engine (default: 1)")
+    parser.add_argument('--concurrency', type=int, default=1000,
+                        help="probes in flight (default: 1000)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write the result rows to this file")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        print("RESULT " + json.dumps(run_child(json.loads(args.child))))
+        return
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    farm = multiprocessing.Process(
+        target=fake_proxies.serve_forever, args=(child_conn,),
+        kwargs={'latency': args.latency, 'drop_rate': args.drop_rate}, daemon=True)
+    farm.start()
+    ports = parent_conn.recv()
+    print(f"Fake proxy farm up: {ports}")
+
+    rows = []
+    try:
+        for engine in args.engines.split(','):
+            for count in (int(c) for c in args.scales.split(',')):
+                print(f"Running {engine} against {count} endpoints...")
+                config = {
+                    'engine': engine, 'count': count, 'ports': ports,
+                    'mix': args.mix or fake_proxies.DEFAULT_MIX, 'seed': args.seed,
+                    'timeout': args.timeout, 'concurrency': args.concurrency,
+                    'prefilter_timeout': args.prefilter_timeout,
+                }
+                proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', json.dumps(config)],
+                                      capture_output=True, text=True)
+                lines = [l for l in proc.stdout.splitlines() if l.startswith('RESULT ')]
+                if proc.returncode != 0 or not lines:
+                    print(f"  {engine} failed:\n{proc.stderr[-2000:]}")
+                    continue
+                rows.append(json.loads(lines[-1][len('RESULT '):]))
+    finally:
+        farm.terminate()
+
+    print()
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import collections
+import mmap
+import os
+import struct
+import sys
+
+from manifest import write_atomic
+from proxyset import pack_endpoint, unpack_endpoint
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Export layout, all little-endian:
+#   header   MAGIC, protocol count k, record count n
+#   index    k x (protocol name, NUL-padded; first record; record count)
+#   records  n x RECORD, grouped by protocol in index order
+# A record is one endpoint listed under its section's protocol. Bit i of
+# `protocols` is set when the endpoint is also listed under the i-th
+# protocol of the index. Active exports keep each section fastest first
+# like active/<protocol>.txt, clean exports keep address order. Nothing in
+# the header records when the file was written, so an export whose records
+# did not change is not rewritten. That holds for clean exports between
+# history changes; active records carry the time of the check that found
+# them working, so active exports change on every run.
+MAGIC = b'PXLIST01'
+HEADER = struct.Struct('<8sII')
+INDEX_ENTRY = struct.Struct('<8sII')
+#   ip uint32, port uint16, protocols uint8, reserved uint8,
+#   latency_ms uint32 (NO_LATENCY if never measured),
+#   last_seen uint32 (unix time the endpoint last worked, 0 if never)
+RECORD = struct.Struct('<IHBxII')
+NO_LATENCY = 0xFFFFFFFF
+
+if np is not None:
+    RECORD_DTYPE = np.dtype([('ip', '<u4'), ('port', '<u2'), ('protocols', 'u1'), ('reserved', 'u1'),
+                             ('latency_ms', '<u4'), ('last_seen', '<u4')])
+
+Record = collections.namedtuple('Record', 'ip port protocols latency_ms last_seen')
+
+
+def encode_export(sections):
+    """
+    Bytes of an export of `sections`, {protocol: [(proxy, latency, last_seen)]}
+    in the order the records should appear, with latency in seconds and
+    last_seen in unix time, either None if unknown. Invalid endpoints are
+    skipped.
+    """
+    protocols = list(sections)
+    if len(protocols) > 8:
+        raise ValueError("at most 8 protocols fit the protocol bits")
+    packed = {proto: [(pack_endpoint(proxy), latency, last_seen)
+                      for proxy, latency, last_seen in entries]
+              for proto, entries in sections.items()}
+    bits = collections.defaultdict(int)
+    for i, proto in enumerate(protocols):
+        for value, _, _ in packed[proto]:
+            if value is not None:
+                bits[value] |= 1 << i
+
+    index, records = [], []
+    for proto in protocols:
+        first = len(records)
+        for value, latency, last_seen in packed[proto]:
+            if value is None:
+                continue
+            latency_ms = NO_LATENCY if latency is None else min(round(latency * 1000), NO_LATENCY - 1)
+            records.append(RECORD.pack(value >> 16, value & 0xFFFF, bits[value],
+                                       latency_ms, round(last_seen or 0)))
+        index.append(INDEX_ENTRY.pack(proto.encode('ascii'), first, len(records) - first))
+    return b''.join([HEADER.pack(MAGIC, len(protocols), len(records))] + index + records)
+
+
+def write_export(path, sections):
+    """
+    Writes encode_export(sections) to `path` if its content changed; returns
+    True if the file was rewritten.
+    """
+    data = encode_export(sections)
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    write_atomic(path, data)
+    return True
+
+
+class ProxyExport:
+    """
+    Read-only, memory-mapped view of an export written by write_export().
+    Opening it reads only the header and index; records are decoded when a
+    section is asked for, with numpy straight out of the mapping if it is
+    installed.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, protocol_count, self.count = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"{path} is not a proxy list export")
+        self.sections = {}
+        for i in range(protocol_count):
+            name, first, count = INDEX_ENTRY.unpack_from(self.mm, HEADER.size + i * INDEX_ENTRY.size)
+            self.sections[name.rstrip(b'\0').decode('ascii')] = (first, count)
+        self.protocols = list(self.sections)
+        self.records_offset = HEADER.size + protocol_count * INDEX_ENTRY.size
+        self.records = None
+        if np is not None:
+            self.records = np.frombuffer(self.mm, dtype=RECORD_DTYPE, count=self.count,
+                                         offset=self.records_offset)
+
+    def __len__(self):
+        return self.count
+
+    def bits(self, *protocols):
+        """Mask of the `protocols` bits, for filtering on Record.protocols."""
+        return sum(1 << self.protocols.index(proto) for proto in protocols)
+
+    def section(self, protocol):
+        """
+        The records of `protocol`: a numpy structured array (a view of the
+        mapping, fields as in RECORD_DTYPE) if numpy is installed, otherwise
+        a list of Records.
+        """
+        first, count = self.sections.get(protocol, (0, 0))
+        if self.records is not None:
+            return self.records[first:first + count]
+        start = self.records_offset + first * RECORD.size
+        return [Record._make(fields) for fields in
+                RECORD.iter_unpack(self.mm[start:start + count * RECORD.size])]
+
+    def proxies(self, protocol, max_latency_ms=None, seen_since=None, also=(), limit=None):
+        """
+        'ip:port' strings of `protocol` in file order, keeping only the ones
+        measured at or below `max_latency_ms`, seen working at or after the
+        unix time `seen_since` and also listed under every protocol in
+        `also`; at most `limit` of them.
+        """
+        records = self.section(protocol)
+        mask = self.bits(*also)
+        if self.records is not None:
+            keep = np.ones(len(records), dtype=bool)
+            if max_latency_ms is not None:
+                keep &= records['latency_ms'] <= max_latency_ms
+            if seen_since is not None:
+                keep &= records['last_seen'] >= seen_since
+            if mask:
+                keep &= (records['protocols'] & mask) == mask
+            selected = records[keep][:limit]
+            return [unpack_endpoint(ip << 16 | port)
+                    for ip, port in zip(selected['ip'].tolist(), selected['port'].tolist())]
+        out = []
+        for r in records:
+            if limit is not None and len(out) >= limit:
+                break
+            if ((max_latency_ms is None or r.latency_ms <= max_latency_ms)
+                    and (seen_since is None or r.last_seen >= seen_since)
+                    and r.protocols & mask == mask):
+                out.append(unpack_endpoint(r.ip << 16 | r.port))
+        return out
+
+    def close(self):
+        # Array views must go before the mapping can be closed
+        self.records = None
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a binary proxy list export (proxies/*.bin).")
+    parser.add_argument('export', help="e.g. proxies/active.bin")
+    parser.add_argument('protocol', nargs='?', help="print this protocol's proxies instead of a summary")
+    parser.add_argument('--max-latency', type=int, metavar='MS', help="only proxies measured at or below MS")
+    parser.add_argument('--limit', type=int, help="print at most this many proxies")
+    args = parser.parse_args()
+
+    with ProxyExport(args.export) as export:
+        if not args.protocol:
+            print(f"{args.export}: {len(export)} records")
+            for proto, (first, count) in export.sections.items():
+                print(f"  {proto}: {count} records from #{first}")
+            return
+        if args.protocol not in export.sections:
+            sys.exit(f"{args.export} has no {args.protocol} section")
+        for proxy in export.proxies(args.protocol, args.max_latency, limit=args.limit):
+            print(proxy)
+
+
+if __name__ == '__main__':
+    main()
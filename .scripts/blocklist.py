@@ -0,0 +1,158 @@
+import array
+import bisect
+import heapq
+import ipaddress
+import time
+
+from proxyset import ProxySet, pack_endpoint
+
+# Learned suppression: a /SUPPRESS_PREFIX subnet in which no endpoint ever
+# worked and at least SUPPRESS_MIN_ENDPOINTS endpoints failed
+# SUPPRESS_MIN_FAILURES checks in a row is not checked for SUPPRESS_FOR
+# seconds after its latest check. After that it gets one more round of
+# checks, which either clears it or suppresses it again.
+SUPPRESS_PREFIX = 24
+SUPPRESS_MIN_ENDPOINTS = 20
+SUPPRESS_MIN_FAILURES = 3
+SUPPRESS_FOR = 7 * 24 * 3600
+
+
+def parse_ports(spec):
+    """'80,443,8000-8100' -> ((80, 80), (443, 443), (8000, 8100)); '' or '*' -> None (all ports)."""
+    if not spec or spec == '*':
+        return None
+    ranges = []
+    for part in spec.split(','):
+        lo, _, hi = part.partition('-')
+        lo, hi = int(lo), int(hi or lo)
+        if not 0 < lo <= hi < 65536:
+            raise ValueError(f"bad port range {part!r}")
+        ranges.append((lo, hi))
+    return tuple(sorted(ranges))
+
+
+def parse_rules(lines, name='<rules>'):
+    """
+    Rules are one per line, `CIDR [PORTS]`, e.g. `104.16.0.0/13` (every
+    port) or `0.0.0.0/0 25,465` (those ports anywhere); `#` starts a
+    comment. Returns [(first_ip, last_ip, ports)].
+    """
+    rules = []
+    for number, line in enumerate(lines, 1):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        try:
+            if len(fields) > 2:
+                raise ValueError("expected `CIDR [PORTS]`")
+            network = ipaddress.IPv4Network(fields[0], strict=False)
+            ports = parse_ports(fields[1] if len(fields) > 1 else None)
+        except ValueError as e:
+            raise ValueError(f"{name}:{number}: {e}") from None
+        rules.append((int(network.network_address), int(network.broadcast_address), ports))
+    return rules
+
+
+def load_rules(path):
+    with open(path, 'r') as f:
+        return parse_rules(f, path)
+
+
+def merge_ports(specs):
+    if any(spec is None for spec in specs):
+        return None
+    merged = []
+    for lo, hi in sorted(r for spec in specs for r in spec):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return tuple(merged)
+
+
+class RangeFilter:
+    """
+    Interval index over (possibly overlapping or nested) address rules:
+    flattened once into sorted, disjoint [start, end] ranges, each with the
+    union of the port sets covering it. Single lookups bisect the starts;
+    split() walks a sorted ProxySet and the ranges side by side.
+    """
+
+    def __init__(self, rules):
+        self.rules = len(rules)
+        self.starts = array.array('Q')
+        self.ends = array.array('Q')
+        self.ports = []
+        by_start = sorted(rules)
+        points = sorted({r[0] for r in rules} | {r[1] + 1 for r in rules})
+        active, i = [], 0
+        for lo, next_lo in zip(points, points[1:]):
+            while i < len(by_start) and by_start[i][0] <= lo:
+                heapq.heappush(active, (by_start[i][1], i, by_start[i][2]))
+                i += 1
+            while active and active[0][0] < lo:
+                heapq.heappop(active)
+            if not active:
+                continue
+            ports = merge_ports([entry[2] for entry in active])
+            if self.ports and self.ends[-1] + 1 == lo and self.ports[-1] == ports:
+                self.ends[-1] = next_lo - 1
+            else:
+                self.starts.append(lo)
+                self.ends.append(next_lo - 1)
+                self.ports.append(ports)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _port_matches(self, slot, port):
+        ports = self.ports[slot]
+        return ports is None or any(lo <= port <= hi for lo, hi in ports)
+
+    def matches(self, value):
+        """Whether a packed endpoint (see proxyset.pack_endpoint) is covered by a rule."""
+        if value is None:
+            return False
+        ip = value >> 16
+        slot = bisect.bisect_right(self.starts, ip) - 1
+        return slot >= 0 and ip <= self.ends[slot] and self._port_matches(slot, value & 0xFFFF)
+
+    def matches_proxy(self, proxy):
+        return self.matches(pack_endpoint(proxy))
+
+    def split(self, proxy_set):
+        """(ProxySet of the endpoints no rule covers, number dropped)."""
+        kept = array.array('Q')
+        slot, n = 0, len(self.starts)
+        for value in proxy_set.values:
+            ip = value >> 16
+            while slot < n and self.ends[slot] < ip:
+                slot += 1
+            if slot < n and self.starts[slot] <= ip and self._port_matches(slot, value & 0xFFFF):
+                continue
+            kept.append(value)
+        return ProxySet(kept), len(proxy_set) - len(kept)
+
+
+def learn_subnets(rows, now=None):
+    """
+    Rules for the subnets that never validate, from ProxyHistory.load()
+    rows ({proxy: (last_checked, last_success, failures, latency)}).
+    """
+    now = now or time.time()
+    subnets = {}
+    mask = (0xFFFFFFFF << (32 - SUPPRESS_PREFIX)) & 0xFFFFFFFF
+    for proxy, (last_checked, last_success, failures, _) in rows.items():
+        value = pack_endpoint(proxy)
+        if value is None or last_checked is None:
+            continue
+        stats = subnets.setdefault((value >> 16) & mask, [0, 0])
+        if last_success is not None:
+            # -1 marks a subnet with evidence it can work
+            stats[0] = -1
+        elif failures >= SUPPRESS_MIN_FAILURES and stats[0] >= 0:
+            stats[0] += 1
+        stats[1] = max(stats[1], last_checked)
+    return [(subnet, subnet | (~mask & 0xFFFFFFFF), None)
+            for subnet, (failed, latest) in subnets.items()
+            if failed >= SUPPRESS_MIN_ENDPOINTS and now - latest < SUPPRESS_FOR]
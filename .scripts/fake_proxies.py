@@ -0,0 +1,190 @@
+import asyncio
+import random
+import socket
+
+import judge
+
+# Behaviours an endpoint generated by endpoints() can have:
+#   ok         - speaks the protocol and tunnels to the local judge
+#   refused    - nothing listens on the port
+#   blackhole  - a listener that never accepts, so connects stall once its
+#                backlog is full
+#   drop       - accepts and closes immediately
+#   slowloris  - accepts and trickles bytes that never complete a reply
+BEHAVIOURS = ['ok', 'refused', 'blackhole', 'drop', 'slowloris']
+DEFAULT_MIX = {'ok': 0.1, 'refused': 0.5, 'blackhole': 0.2, 'drop': 0.1, 'slowloris': 0.1}
+
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+class FakeProxyFarm:
+    """
+    Local HTTP/SOCKS4/SOCKS5 proxies plus the built-in judge, all on
+    loopback. Servers listen on every address so endpoints can spread over
+    127.0.0.0/8 and a benchmark can use far more distinct endpoints than
+    there are ports.
+    """
+
+    def __init__(self, latency=0.0, drop_rate=0.0, trickle_interval=1.0, host='0.0.0.0'):
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.trickle_interval = trickle_interval
+        self.host = host
+        self.ports = {}
+        self.servers = []
+        self.blackhole = None
+
+    async def tunnel(self, reader, writer):
+        judge_reader, judge_writer = await asyncio.open_connection('127.0.0.1', self.ports['judge'])
+        await asyncio.gather(pipe(reader, judge_writer), pipe(judge_reader, writer))
+
+    async def should_drop(self, writer):
+        if self.drop_rate and random.random() < self.drop_rate:
+            writer.close()
+            return True
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return False
+
+    async def http_proxy(self, reader, writer):
+        try:
+            if await self.should_drop(writer):
+                return
+            head = await reader.readuntil(b'\r\n\r\n')
+            if head.startswith(b'CONNECT '):
+                writer.write(b'HTTP/1.1 200 Connection established\r\n\r\n')
+                await self.tunnel(reader, writer)
+            else:
+                # Forward mode: replay the request line towards the judge
+                judge_reader, judge_writer = await asyncio.open_connection('127.0.0.1', self.ports['judge'])
+                judge_writer.write(head)
+                await asyncio.gather(pipe(reader, judge_writer), pipe(judge_reader, writer))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            writer.close()
+
+    async def socks4_proxy(self, reader, writer):
+        try:
+            if await self.should_drop(writer):
+                return
+            await reader.readexactly(8)
+            await reader.readuntil(b'\x00')
+            writer.write(b'\x00\x5a' + b'\x00' * 6)
+            await self.tunnel(reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            writer.close()
+
+    async def socks5_proxy(self, reader, writer):
+        try:
+            if await self.should_drop(writer):
+                return
+            greeting = await reader.readexactly(2)
+            await reader.readexactly(greeting[1])
+            writer.write(b'\x05\x00')
+            head = await reader.readexactly(4)
+            if head[3] == 0x01:
+                await reader.readexactly(4 + 2)
+            elif head[3] == 0x04:
+                await reader.readexactly(16 + 2)
+            else:
+                length = (await reader.readexactly(1))[0]
+                await reader.readexactly(length + 2)
+            writer.write(b'\x05\x00\x00\x01' + b'\x00' * 6)
+            await self.tunnel(reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            writer.close()
+
+    async def drop(self, reader, writer):
+        writer.close()
+
+    async def slowloris(self, reader, writer):
+        try:
+            while True:
+                writer.write(b'H')
+                await writer.drain()
+                await asyncio.sleep(self.trickle_interval)
+        except (ConnectionError, OSError):
+            writer.close()
+
+    async def start(self):
+        handlers = {
+            'judge': judge.handle_request,
+            'http/ok': self.http_proxy,
+            'socks4/ok': self.socks4_proxy,
+            'socks5/ok': self.socks5_proxy,
+            'drop': self.drop,
+            'slowloris': self.slowloris,
+        }
+        for key, handler in handlers.items():
+            server = await asyncio.start_server(handler, self.host, 0, backlog=4096)
+            self.servers.append(server)
+            self.ports[key] = server.sockets[0].getsockname()[1]
+
+        self.blackhole = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.blackhole.bind((self.host, 0))
+        self.blackhole.listen(0)
+        self.ports['blackhole'] = self.blackhole.getsockname()[1]
+
+        # A port that was free a moment ago is refused from now on
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind((self.host, 0))
+        self.ports['refused'] = probe.getsockname()[1]
+        probe.close()
+        return self
+
+    async def close(self):
+        for server in self.servers:
+            server.close()
+        if self.blackhole:
+            self.blackhole.close()
+
+
+def endpoints(ports, protocol, count, mix=None, seed=0):
+    """
+    `count` endpoints for `protocol` spread over 127.0.0.0/8, with
+    behaviours drawn according to `mix`. `ports` is FakeProxyFarm.ports.
+    Returns [(endpoint, behaviour)].
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(f"{seed}-{protocol}")
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    out = []
+    for i in range(count):
+        behaviour = rng.choices(names, weights)[0]
+        port = ports.get(f"{protocol}/{behaviour}") or ports[behaviour]
+        n = i + 1
+        host = f"127.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+        out.append((f"{host}:{port}", behaviour))
+    return out
+
+
+def serve_forever(conn, **options):
+    """multiprocessing target: runs a farm and sends its ports over `conn`."""
+    async def main():
+        farm = await FakeProxyFarm(**options).start()
+        conn.send(farm.ports)
+        await asyncio.Event().wait()
+    asyncio.run(main())
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, share = part.partition('=')
+        if name not in BEHAVIOURS:
+            raise ValueError(f"unknown behaviour {name!r}, expected one of {BEHAVIOURS}")
+        mix[name] = float(share)
+    return mix
+
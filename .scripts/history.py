@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import time
+
+from async_checker import is_decided
+
+# A proxy that failed once is retried on the next run; every further
+# consecutive failure doubles the wait, up to MAX_BACKOFF. Runs happen every
+# 6 hours, so BACKOFF_BASE sits slightly below that to absorb cron jitter.
+BACKOFF_BASE = 5 * 3600
+MAX_BACKOFF = 7 * 24 * 3600
+
+# Entries not listed by any source for this long are dropped from the store.
+FORGET_AFTER = 30 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS proxy_history (
+    proxy TEXT NOT NULL,
+    protocol TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    last_checked REAL,
+    last_success REAL,
+    consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    last_latency REAL,
+    PRIMARY KEY (proxy, protocol)
+)
+"""
+
+
+def backoff_delay(failures):
+    if failures <= 0:
+        return 0
+    return min(BACKOFF_BASE * 2 ** (failures - 1), MAX_BACKOFF)
+
+
+def is_due(entry, now):
+    """Whether a row returned by ProxyHistory.load() should be checked at `now`."""
+    if entry is None or entry[0] is None:
+        return True
+    last_checked, _, failures, _ = entry
+    return now - last_checked >= backoff_delay(failures)
+
+
+class ProxyHistory:
+    """
+    On-disk record of every proxy's check outcomes, used to decide which
+    proxies are worth checking on the next run and in which order.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        # Shard processes may share one file; wait for locks instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute(SCHEMA)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load(self, protocol):
+        rows = self.conn.execute(
+            "SELECT proxy, last_checked, last_success, consecutive_failures, last_latency "
+            "FROM proxy_history WHERE protocol = ?", (protocol,))
+        return {row[0]: row[1:] for row in rows}
+
+    def plan(self, proxies, protocol, now=None):
+        """
+        Splits `proxies` into (to_check, skipped). Proxies that were alive
+        last time come first (most recent success first), then never-checked
+        ones, then failing ones whose backoff has expired. Failing proxies
+        still inside their backoff window are skipped.
+        """
+        now = now or time.time()
+        known = self.load(protocol)
+        self.touch(proxies, protocol, now)
+
+        alive, new, retry, skipped = [], [], [], []
+        for proxy in proxies:
+            entry = known.get(proxy)
+            if entry is None or entry[0] is None:
+                new.append(proxy)
+                continue
+
+            _, last_success, failures, _ = entry
+            if failures == 0:
+                alive.append((-(last_success or 0), proxy))
+            elif is_due(entry, now):
+                retry.append((failures, proxy))
+            else:
+                skipped.append(proxy)
+
+        alive.sort()
+        retry.sort()
+        to_check = [p for _, p in alive] + new + [p for _, p in retry]
+        return to_check, skipped
+
+    def touch(self, proxies, protocol, now=None):
+        """Marks `proxies` as listed by a source at `now`, adding unknown ones."""
+        now = now or time.time()
+        self.conn.executemany(
+            "INSERT INTO proxy_history (proxy, protocol, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (proxy, protocol) DO UPDATE SET last_seen = excluded.last_seen",
+            ((p, protocol, now, now) for p in proxies))
+        self.conn.commit()
+
+    def record(self, results, protocol, now=None):
+        """
+        Stores the outcome of a check run; `results` are ProbeResult tuples.
+        Working proxies without a row yet (found under a protocol no source
+        listed them for) are added. Undecided results (see
+        async_checker.UNDECIDED_ERRORS) leave their proxy's row untouched.
+        """
+        now = now or time.time()
+        results = [r for r in results if is_decided(r)]
+        self.touch([r.proxy for r in results if r.ok], protocol, now)
+        self.conn.executemany(
+            "UPDATE proxy_history SET last_checked = ?, last_success = ?, "
+            "consecutive_failures = 0, last_latency = ? WHERE proxy = ? AND protocol = ?",
+            ((now, now, r.elapsed, r.proxy, protocol) for r in results if r.ok))
+        self.conn.executemany(
+            "UPDATE proxy_history SET last_checked = ?, "
+            "consecutive_failures = consecutive_failures + 1 WHERE proxy = ? AND protocol = ?",
+            ((now, r.proxy, protocol) for r in results if not r.ok))
+        self.conn.commit()
+
+    def prune(self, now=None):
+        now = now or time.time()
+        cur = self.conn.execute("DELETE FROM proxy_history WHERE last_seen < ?",
+                                (now - FORGET_AFTER,))
+        self.conn.commit()
+        return cur.rowcount
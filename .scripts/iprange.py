@@ -0,0 +1,172 @@
+import argparse
+import array
+import bisect
+import gzip
+import ipaddress
+import mmap
+import struct
+import sys
+
+from manifest import write_atomic
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Compiled index layout, all little-endian:
+#   header   MAGIC, range count n
+#   starts   uint32[n]   first address of each range, ascending
+#   ends     uint32[n]   last address of each range
+#   asns     uint32[n]   0 if unknown
+#   country  char[2][n]  ISO 3166 code, b'\0\0' if unknown
+# The columns are read straight out of the mmap, so opening the index costs
+# nothing and lookups touch only the pages binary search visits.
+MAGIC = b'PXRANGE1'
+HEADER = struct.Struct('<8sI')
+
+# Free IPv4 -> ASN/country database this module compiles by default
+IP2ASN_URL = 'https://iptoasn.com/data/ip2asn-v4.tsv.gz'
+
+
+def read_ip2asn(path):
+    """
+    Yields (start, end, asn, country) from an iptoasn.com ip2asn-v4 TSV
+    (optionally gzipped): range_start, range_end, AS number, country code,
+    AS description. Unrouted ranges (AS 0) are skipped.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 4 or fields[2] == '0':
+                continue
+            try:
+                start = int(ipaddress.IPv4Address(fields[0]))
+                end = int(ipaddress.IPv4Address(fields[1]))
+                asn = int(fields[2])
+            except ValueError:
+                continue
+            code = fields[3]
+            # Anything but two ASCII letters ('None', 'Unknown', ...) means unknown
+            country = code.upper() if len(code) == 2 and code.isascii() and code.isalpha() else ''
+            yield start, end, asn, country
+
+
+def compile_index(ranges, path):
+    """Writes (start, end, asn, country) ranges to a sorted index at `path`; returns the count."""
+    ranges = sorted(ranges)
+    columns = [array.array('I', (r[i] for r in ranges)) for i in (0, 1, 2)]
+    if sys.byteorder != 'little':
+        for column in columns:
+            column.byteswap()
+    countries = b''.join(r[3].encode('ascii', 'replace')[:2].ljust(2, b'\0') for r in ranges)
+    write_atomic(path, b''.join([HEADER.pack(MAGIC, len(ranges))] +
+                                [column.tobytes() for column in columns] + [countries]))
+    return len(ranges)
+
+
+class IpRangeIndex:
+    """Read-only, memory-mapped view of an index written by compile_index()."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"{path} is not a compiled IP range index")
+        n = self.count
+        offset = HEADER.size
+        if np is not None:
+            self.starts, self.ends, self.asns = (
+                np.frombuffer(self.mm, dtype='<u4', count=n, offset=offset + i * 4 * n)
+                for i in range(3))
+            self.codes = np.frombuffer(self.mm, dtype='S2', count=n, offset=offset + 12 * n)
+        else:
+            view = memoryview(self.mm)
+            self.starts, self.ends, self.asns = (
+                self._column(view[offset + i * 4 * n:offset + (i + 1) * 4 * n]) for i in range(3))
+            self.codes = None
+        self.countries_offset = offset + 12 * n
+
+    @staticmethod
+    def _column(view):
+        if sys.byteorder == 'little':
+            return view.cast('I')
+        # Big-endian hosts pay for one copy instead of mapping in place
+        column = array.array('I', view.tobytes())
+        column.byteswap()
+        return column
+
+    def country(self, i):
+        code = self.mm[self.countries_offset + 2 * i:self.countries_offset + 2 * i + 2]
+        return code.decode('ascii') if code != b'\0\0' else None
+
+    def lookup(self, ips):
+        """
+        Maps IPv4 addresses (ints, best sorted ascending) to (country, asn),
+        with None for either when unknown. Returns a list parallel to `ips`.
+        """
+        if np is not None:
+            queries = np.asarray(ips, dtype=np.uint64)
+            slots = np.searchsorted(self.starts, queries, side='right') - 1
+            found = (slots >= 0) & (queries <= self.ends[np.maximum(slots, 0)])
+            safe = np.where(found, slots, 0)
+            countries = [c.decode('ascii') or None for c in self.codes[safe].tolist()]
+            asns = self.asns[safe].tolist()
+            return [(countries[i], asns[i] or None) if ok else (None, None)
+                    for i, ok in enumerate(found.tolist())]
+        slots, found, lo, previous = [], [], 0, -1
+        for ip in ips:
+            # Sorted queries only ever move right, so each search starts
+            # where the previous one ended
+            if ip < previous:
+                lo = 0
+            slot = bisect.bisect_right(self.starts, ip, lo) - 1
+            lo, previous = max(slot, 0), ip
+            slots.append(slot)
+            found.append(slot >= 0 and ip <= self.ends[slot])
+        return [(self.country(s), self.asns[s] or None) if ok else (None, None)
+                for s, ok in zip(slots, found)]
+
+    def lookup_endpoints(self, proxy_set):
+        """{endpoint: (country, asn)} for a ProxySet, in one bulk lookup."""
+        ips = [value >> 16 for value in proxy_set.values]
+        return {endpoint: meta for endpoint, meta in zip(proxy_set, self.lookup(ips))}
+
+    def close(self):
+        # Column views must go before the mapping can be closed
+        self.starts = self.ends = self.asns = self.codes = None
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile and query the offline IP -> country/ASN index.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('compile', help=f"compile an ip2asn-v4 TSV (from {IP2ASN_URL})")
+    build.add_argument('source', help="ip2asn-v4.tsv or ip2asn-v4.tsv.gz")
+    build.add_argument('-o', '--output', required=True, help="index file to write")
+    query = commands.add_parser('lookup', help="look addresses up in a compiled index")
+    query.add_argument('index')
+    query.add_argument('ips', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'compile':
+        count = compile_index(read_ip2asn(args.source), args.output)
+        print(f"Compiled {count} ranges into {args.output}")
+    else:
+        with IpRangeIndex(args.index) as index:
+            for ip, (country, asn) in zip(args.ips, index.lookup(
+                    [int(ipaddress.IPv4Address(ip)) for ip in args.ips])):
+                print(f"{ip}\t{country or '-'}\t{f'AS{asn}' if asn else '-'}")
+
+
+if __name__ == '__main__':
+    main()
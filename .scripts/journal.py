@@ -0,0 +1,101 @@
+import json
+import os
+import time
+
+from async_checker import ProbeResult, is_decided
+from manifest import write_atomic
+
+# Seconds between flushes of partial results (active lists or shard files)
+# while a check phase is still running
+CHECKPOINT_INTERVAL = 60
+
+
+class ResultJournal:
+    """
+    Append-only JSONL of the ProbeResults a check run has decided, so a run
+    that gets killed can be restarted without re-checking them. The first
+    line identifies the run (e.g. its shard and the hashes of the clean
+    lists); a journal left by a run over different input is discarded
+    rather than resumed.
+    """
+
+    def __init__(self, path, identity):
+        self.path = path
+        self.identity = identity
+        # {protocol: {proxy: ProbeResult}} decided by an earlier attempt
+        self.resumed = self._load() or {}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Rewritten from what loaded cleanly, so a line torn by the kill
+        # does not swallow the first record appended after it
+        write_atomic(path, ''.join(
+            [json.dumps({'journal': identity}) + '\n'] +
+            [json.dumps(r._asdict()) + '\n' for by_proxy in self.resumed.values()
+             for r in by_proxy.values()]).encode())
+        self.file = open(path, 'a')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return None
+        resumed = {}
+        with open(self.path, 'r') as f:
+            for number, line in enumerate(f):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if number == 0:
+                    if entry.get('journal') != self.identity:
+                        print(f"Journal {self.path} is from a different run, starting over")
+                        return None
+                    continue
+                result = ProbeResult(**entry)
+                resumed.setdefault(result.protocol, {})[result.proxy] = result
+        return resumed
+
+    def __len__(self):
+        return sum(len(by_proxy) for by_proxy in self.resumed.values())
+
+    def decided(self, protocol):
+        return self.resumed.get(protocol, {})
+
+    def append(self, results):
+        # Undecided results are left for the resumed run to probe again
+        for r in filter(is_decided, results):
+            self.file.write(json.dumps(r._asdict()) + '\n')
+        # Reaches the OS on every call, so only a machine crash loses results
+        self.file.flush()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self, finished=False):
+        """Closes the journal; a `finished` run has no use for it any more."""
+        self.file.close()
+        if finished:
+            os.remove(self.path)
+
+
+class Checkpointer:
+    """
+    on_result callback that journals every result and hands everything
+    decided so far to `flush` at most every `interval` seconds.
+    """
+
+    def __init__(self, journal, flush=None, interval=CHECKPOINT_INTERVAL, on_result=None):
+        self.journal = journal
+        self.flush = flush
+        self.interval = interval
+        self.on_result = on_result
+        self.results = []
+        self.last_flush = time.monotonic()
+
+    def __call__(self, result):
+        self.journal.append([result])
+        self.results.append(result)
+        if self.on_result:
+            self.on_result(result)
+        if self.flush and time.monotonic() - self.last_flush >= self.interval:
+            self.journal.sync()
+            self.flush(self.results)
+            self.last_flush = time.monotonic()
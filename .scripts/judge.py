@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Public judges used when none are configured. Plain HTTP so the async
+# engine can talk to them through a tunnel without TLS; a self-hosted judge
+# (see serve() below) avoids their rate limits altogether.
+DEFAULT_JUDGES = [
+    'http://httpbin.org/ip',
+    'http://api.ipify.org/?format=json',
+    'http://ifconfig.me/ip',
+]
+
+# After this many judge faults in a row a judge is benched for COOLDOWN
+# seconds, doubling on every further fault up to MAX_COOLDOWN.
+MAX_FAULTS = 5
+COOLDOWN = 30
+MAX_COOLDOWN = 600
+
+# Statuses that are the judge's doing even when the request went through a
+# forwarding proxy (rate limiting); through a tunnel every non-200 is.
+JUDGE_FAULT_STATUSES = {429}
+
+MAX_BODY_BYTES = 4096
+MAX_REQUEST_BYTES = 16384
+
+
+class Judge:
+    """One judge URL plus the counters JudgePool uses to pick between judges."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"judge URL must be http(s)://host[:port]/path, got {url!r}")
+        self.url = url
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.ip = None
+        self.in_flight = 0
+        self.successes = 0
+        self.faults = 0
+        self.consecutive_faults = 0
+        self.benched_until = 0
+
+    @property
+    def host_header(self):
+        default = 443 if self.scheme == 'https' else 80
+        return self.host if self.port == default else f"{self.host}:{self.port}"
+
+    def __repr__(self):
+        return f"Judge({self.url!r})"
+
+
+class JudgePool:
+    """
+    Spreads probes over several judges: each probe goes to the healthy judge
+    with the fewest probes in flight. Judges that keep failing on their own
+    account (rate limiting, errors behind a working tunnel) are benched for
+    a while. Safe to share between threads.
+    """
+
+    def __init__(self, urls=None, max_faults=MAX_FAULTS, cooldown=COOLDOWN):
+        self.judges = [Judge(url) for url in (urls or DEFAULT_JUDGES)]
+        if not self.judges:
+            raise ValueError("judge pool is empty")
+        self.max_faults = max_faults
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.turn = 0
+
+    async def resolve(self):
+        """Looks up IPv4 addresses, which SOCKS4 needs to address the judge."""
+        loop = asyncio.get_running_loop()
+        for judge in self.judges:
+            if judge.ip is not None:
+                continue
+            try:
+                infos = await loop.getaddrinfo(judge.host, judge.port,
+                                               family=socket.AF_INET, type=socket.SOCK_STREAM)
+                judge.ip = infos[0][4][0]
+            except OSError:
+                pass
+
+    def acquire(self, exclude=None, need_ip=False):
+        """
+        Picks a judge and counts a probe in flight on it; release() must
+        follow. Returns None if no judge qualifies.
+        """
+        now = time.monotonic()
+        with self.lock:
+            eligible = [j for j in self.judges
+                        if j is not exclude and (j.ip is not None or not need_ip)]
+            if not eligible:
+                return None
+            healthy = [j for j in eligible if j.benched_until <= now]
+            # With every judge benched, the one coming back soonest still serves
+            candidates = healthy or [min(eligible, key=lambda j: j.benched_until)]
+            self.turn += 1
+            n = len(candidates)
+            judge = min((candidates[(self.turn + i) % n] for i in range(n)),
+                        key=lambda j: j.in_flight)
+            judge.in_flight += 1
+            return judge
+
+    def release(self, judge, fault=None):
+        """
+        Ends a probe on `judge`. `fault` is True when the judge itself failed,
+        False when it answered, None when the outcome says nothing about it.
+        """
+        with self.lock:
+            judge.in_flight -= 1
+            if fault is None:
+                return
+            if not fault:
+                judge.successes += 1
+                judge.consecutive_faults = 0
+                return
+            judge.faults += 1
+            judge.consecutive_faults += 1
+            extra = judge.consecutive_faults - self.max_faults
+            if extra >= 0:
+                delay = min(self.cooldown * 2 ** extra, MAX_COOLDOWN)
+                judge.benched_until = time.monotonic() + delay
+
+    def summary(self):
+        return ', '.join(f"{j.host_header} {j.successes} ok/{j.faults} faults"
+                         for j in self.judges)
+
+
+def parse_exit_ip(body):
+    """
+    Extracts the caller IP from a judge response body: JSON with an 'ip' or
+    'origin' field (httpbin, ipify, the built-in judge) or a bare address.
+    """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    text = body.strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        text = str(data.get('ip') or data.get('origin') or '')
+    # httpbin lists every hop for forwarded requests: "client, proxy"
+    text = text.split(',')[0].strip()
+    try:
+        return str(ipaddress.ip_address(text))
+    except ValueError:
+        return None
+
+
+async def handle_request(reader, writer):
+    """
+    Built-in judge: answers any request with the caller's address and the
+    request headers as compact JSON, e.g.
+    {"ip":"203.0.113.5","headers":{"Host":"judge","Via":"1.1 squid"}}.
+    Headers such as Via or X-Forwarded-For reveal non-anonymous proxies.
+    """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+        headers = {}
+        for line in head.decode('latin-1').split('\r\n')[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip()] = value.strip()
+        peer = writer.get_extra_info('peername')
+        body = json.dumps({'ip': peer[0] if peer else None, 'headers': headers},
+                          separators=(',', ':')).encode()
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() +
+                     b'\r\nConnection: close\r\n\r\n' + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host='127.0.0.1', port=0):
+    return await asyncio.start_server(handle_request, host, port,
+                                      limit=MAX_REQUEST_BYTES, backlog=4096)
+
+
+def serve(host='127.0.0.1', port=8080):
+    async def main():
+        server = await start_server(host, port)
+        bound = server.sockets[0].getsockname()
+        print(f"Judge listening on http://{bound[0]}:{bound[1]}/")
+        async with server:
+            await server.serve_forever()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Self-hosted proxy judge: echoes caller IP and headers.")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on; use 0.0.0.0 to expose it (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8080, help="port to listen on (default: 8080)")
+    args = parser.parse_args()
+    serve(args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
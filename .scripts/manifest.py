@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import time
+
+from proxyset import ProxySet
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def write_atomic(path, data):
+    """Replaces `path` with `data` (bytes) so readers never see a partial file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ListManifest:
+    """
+    proxies/manifest.json: one entry per written list, keyed
+    '<group>/<protocol>' (group being a source name or clean/active/fastest),
+    with its entry count, sha256, how many entries were added and removed
+    compared to the previous write, when it was last written and when its
+    content last changed. Lists are only rewritten when their content
+    differs, so unchanged files keep their mtime and produce no git diff.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.path = os.path.join(base_dir, MANIFEST_NAME)
+        self.lists = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.lists = json.load(f).get('lists', {})
+
+    def write_list(self, key, lines):
+        """
+        Writes `lines` (a ProxySet, or endpoints already in the order they
+        should appear) to <base_dir>/<key>.txt if the content changed.
+        Returns True if the file was rewritten.
+        """
+        path = os.path.join(self.base_dir, f"{key}.txt")
+        new = lines if isinstance(lines, ProxySet) else None
+        lines = list(lines)
+        data = ('\n'.join(lines) + '\n').encode()
+        digest = hashlib.sha256(data).hexdigest()
+        now = round(time.time())
+        entry = self.lists.get(key)
+        if (entry and entry['sha256'] == digest and os.path.exists(path)
+                and os.path.getsize(path) == len(data)):
+            entry.update(added=0, removed=0, written=now)
+            return False
+
+        previous = b''
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                previous = f.read()
+        changed = previous != data
+        if changed:
+            if new is None:
+                new = ProxySet.from_lines(lines)
+            old = ProxySet.from_lines(previous.decode().splitlines())
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, data)
+        self.lists[key] = {
+            'path': os.path.relpath(path, self.base_dir),
+            'count': len(lines),
+            'sha256': digest,
+            'added': len(new.difference(old)) if changed else 0,
+            'removed': len(old.difference(new)) if changed else 0,
+            'written': now,
+            # A file seen for the first time unchanged keeps its own mtime
+            'changed': now if changed else round(os.path.getmtime(path)),
+        }
+        return changed
+
+    def remove_list(self, key):
+        path = os.path.join(self.base_dir, f"{key}.txt")
+        if os.path.exists(path):
+            os.remove(path)
+        self.lists.pop(key, None)
+
+    def prune(self):
+        """Drops entries whose file no longer exists."""
+        for key in [k for k, e in self.lists.items()
+                    if not os.path.exists(os.path.join(self.base_dir, e['path']))]:
+            del self.lists[key]
+
+    def count(self, key):
+        entry = self.lists.get(key)
+        return entry['count'] if entry else 0
+
+    def save(self):
+        self.prune()
+        data = json.dumps({'generated': round(time.time()), 'lists': self.lists},
+                          indent=2, sort_keys=True) + '\n'
+        write_atomic(self.path, data.encode())
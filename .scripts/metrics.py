@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from manifest import write_atomic
+
+# Every metric the pipeline records: name -> (Prometheus type, help text).
+METRICS = {
+    'proxy_run_timestamp_seconds': ('gauge', "Unix time the run wrote this report"),
+    'proxy_run_duration_seconds': ('gauge', "Wall-clock seconds of the whole run"),
+    'proxy_stage_duration_seconds': ('gauge', "Wall-clock seconds per pipeline stage"),
+    'proxy_source_scheduled': ('gauge', "1 if the source was fetched this run, 0 if its schedule skipped it"),
+    'proxy_source_ok': ('gauge', "1 if the source's fetch finished cleanly, 0 on error or timeout"),
+    'proxy_source_fetch_seconds': ('gauge', "Wall-clock seconds a source spent fetching"),
+    'proxy_source_requests_total': ('counter', "HTTP requests (pages) a source made"),
+    'proxy_source_bytes_total': ('counter', "Response body bytes a source received"),
+    'proxy_source_parse_seconds': ('gauge', "Seconds a source spent parsing responses"),
+    'proxy_source_cache_hits_total': ('counter', "Responses served from the revalidation cache"),
+    'proxy_source_proxies': ('gauge', "Proxies a source listed, by protocol"),
+    'proxy_dedup_input_proxies': ('gauge', "Proxies entering deduplication, by protocol"),
+    'proxy_dedup_output_proxies': ('gauge', "Unique proxies after deduplication, by protocol"),
+    'proxy_blocklist_dropped_total': ('counter', "Endpoints dropped by blocklist rules (static) or suppressed subnets (learned)"),
+    'proxy_prefilter_dropped_total': ('counter', "Proxies dropped by the TCP pre-filter"),
+    'proxy_checks_total': ('counter', "Finished probes by protocol and outcome"),
+    'proxy_checks_per_second': ('gauge', "Probe throughput of a protocol check phase"),
+    'proxy_checker_in_flight': ('gauge', "Probes currently in flight"),
+    'proxy_checker_in_flight_peak': ('gauge', "Most probes in flight at once"),
+    'proxy_active_proxies': ('gauge', "Working proxies saved, by protocol"),
+}
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """
+    Thread-safe registry of labelled metric values and timed stage spans
+    for one run. `labels` are added to every series, e.g. the shard of a
+    sharded run so its textfile does not clash with the other shards'.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.origin = time.monotonic()
+            self.labels = {}
+            self.values = {}
+            self.spans = []
+
+    def key(self, name, labels):
+        if name not in METRICS:
+            raise KeyError(f"unknown metric {name}")
+        return name, tuple(sorted(labels.items()))
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[self.key(name, labels)] = value
+
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    @contextmanager
+    def in_flight(self):
+        """Counts a probe in flight for the duration of the block."""
+        now_key = self.key('proxy_checker_in_flight', {})
+        peak_key = self.key('proxy_checker_in_flight_peak', {})
+        with self.lock:
+            current = self.values.get(now_key, 0) + 1
+            self.values[now_key] = current
+            if current > self.values.get(peak_key, 0):
+                self.values[peak_key] = current
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.values[now_key] -= 1
+
+    def add_span(self, stage, start, seconds, **labels):
+        """Records a finished stage; `start` is a time.monotonic() value."""
+        with self.lock:
+            self.spans.append({'stage': stage, 'labels': labels,
+                               'start': round(start - self.origin, 3),
+                               'seconds': round(seconds, 3)})
+        self.set('proxy_stage_duration_seconds', round(seconds, 3), stage=stage, **labels)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_span(stage, start, time.monotonic() - start, **labels)
+
+    def finish(self):
+        self.set('proxy_run_timestamp_seconds', round(time.time(), 3))
+        self.set('proxy_run_duration_seconds', round(time.monotonic() - self.origin, 3))
+
+    def report(self):
+        with self.lock:
+            series = [{'name': name, 'labels': {**self.labels, **dict(labels)}, 'value': value}
+                      for (name, labels), value in sorted(self.values.items(), key=str)]
+            return {
+                'started': self.started,
+                'labels': dict(self.labels),
+                'metrics': series,
+                'spans': list(self.spans),
+            }
+
+    def prometheus(self):
+        lines = []
+        by_name = {}
+        for entry in self.report()['metrics']:
+            by_name.setdefault(entry['name'], []).append(entry)
+        for name in sorted(by_name):
+            kind, help_text = METRICS[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for entry in by_name[name]:
+                labels = ','.join(f'{k}="{escape(v)}"' for k, v in sorted(entry['labels'].items()))
+                lines.append(f"{name}{{{labels}}} {entry['value']}" if labels
+                             else f"{name} {entry['value']}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory, name):
+        """Writes <name>.json (report with trace spans) and <name>.prom (Prometheus textfile)."""
+        self.finish()
+        os.makedirs(directory, exist_ok=True)
+        # Readers such as node_exporter's textfile collector never see a torn file
+        write_atomic(os.path.join(directory, f"{name}.json"), json.dumps(self.report(), indent=2).encode())
+        write_atomic(os.path.join(directory, f"{name}.prom"), self.prometheus().encode())
+        return os.path.join(directory, f"{name}.json")
+
+
+# Process-wide registry; shard worker processes reset() their inherited copy
+metrics = Metrics()
@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs, urlsplit
+
+import async_checker
+import judge
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_DIR = os.path.join(ROOT_DIR, "proxies")
+PROTOCOLS = ['http', 'socks4', 'socks5']
+STRATEGIES = ['round-robin', 'lru', 'latency']
+
+# A proxy that passes a check is live for MIN_TTL seconds; every further
+# pass in a row doubles that up to MAX_TTL, since proxies that stayed up
+# tend to stay up. Revalidation always takes the soonest-expiring first.
+MIN_TTL = 60
+MAX_TTL = 15 * 60
+
+# Failed or reported proxies are re-probed after QUARANTINE seconds,
+# doubling per failure; after MAX_FAILURES in a row they are forgotten
+# until a list file lists them again.
+QUARANTINE = 5 * 60
+MAX_FAILURES = 3
+
+# Probes that could not decide (see async_checker.UNDECIDED_ERRORS) are
+# retried after this many seconds without changing the proxy's standing
+UNDECIDED_RETRY = 30
+
+# How often the list files are looked at for new endpoints
+RELOAD_INTERVAL = 5 * 60
+
+# Weight of the newest probe in a proxy's smoothed latency
+LATENCY_SMOOTHING = 0.3
+# Floor for latency-weighted picks so one very quick proxy does not take all traffic
+MIN_WEIGHT_LATENCY = 0.05
+
+
+class PoolEntry:
+    __slots__ = ('proxy', 'protocol', 'latency', 'streak', 'failures', 'checked',
+                 'expires', 'live', 'version', 'last_used', 'uses')
+
+    def __init__(self, proxy, protocol):
+        self.proxy = proxy
+        self.protocol = protocol
+        self.latency = None
+        self.streak = 0
+        self.failures = 0
+        self.checked = None
+        self.expires = None
+        self.live = False
+        # Bumped on every reschedule; probes and heap items carrying an
+        # older version are stale and ignored
+        self.version = 0
+        self.last_used = None
+        self.uses = 0
+
+    def as_dict(self):
+        return {
+            'proxy': self.proxy,
+            'protocol': self.protocol,
+            'latency_ms': None if self.latency is None else round(self.latency * 1000, 1),
+            'checked': self.checked,
+            'expires': self.expires,
+            'uses': self.uses,
+        }
+
+
+class ProxyPool:
+    """
+    In-memory pool of proxies keyed (protocol, proxy). Every tracked proxy
+    sits in one revalidation heap ordered by when it is due; live ones are
+    also in the rotation structures each strategy picks from. Not
+    thread-safe: the daemon drives it from a single event loop.
+    """
+
+    def __init__(self, min_ttl=MIN_TTL, max_ttl=MAX_TTL):
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.entries = {}
+        self.schedule = []
+        self.seq = itertools.count()
+        # Keyed by protocol, plus None for picks across every protocol
+        self.rotation = {p: deque() for p in PROTOCOLS + [None]}
+        # Keys with a token in the matching rotation deque: one each, so the
+        # deques never outgrow the pool whatever the strategies in use
+        self.queued = {p: set() for p in PROTOCOLS + [None]}
+        self.recency = {p: OrderedDict() for p in PROTOCOLS + [None]}
+        self.counters = {'checks': 0, 'admitted': 0, 'evicted': 0, 'reported': 0,
+                         'forgotten': 0, 'served': 0}
+
+    def _reschedule(self, entry, due):
+        entry.version += 1
+        heapq.heappush(self.schedule, (due, next(self.seq), entry.protocol, entry.proxy, entry.version))
+
+    def track(self, proxy, protocol, now=None):
+        """Queues an endpoint for its first check; known endpoints are left alone."""
+        key = (protocol, proxy)
+        if key in self.entries:
+            return False
+        entry = self.entries[key] = PoolEntry(proxy, protocol)
+        self._reschedule(entry, now or time.time())
+        return True
+
+    def pop_due(self, now):
+        """The next (entry, version) whose check is due, or None."""
+        while self.schedule and self.schedule[0][0] <= now:
+            _, _, protocol, proxy, version = heapq.heappop(self.schedule)
+            entry = self.entries.get((protocol, proxy))
+            if entry and entry.version == version:
+                return entry, version
+        return None
+
+    def next_due(self):
+        return self.schedule[0][0] if self.schedule else None
+
+    def _admit(self, entry):
+        entry.live = True
+        key = (entry.protocol, entry.proxy)
+        for group in (entry.protocol, None):
+            if key not in self.queued[group]:
+                self.queued[group].add(key)
+                self.rotation[group].append(key)
+            # Never-used proxies are the least recently used ones
+            self.recency[group][key] = None
+            self.recency[group].move_to_end(key, last=False)
+        self.counters['admitted'] += 1
+
+    def _evict(self, entry):
+        entry.live = False
+        key = (entry.protocol, entry.proxy)
+        for group in (entry.protocol, None):
+            self.recency[group].pop(key, None)
+        # rotation deques drop evicted keys lazily in pick()
+        self.counters['evicted'] += 1
+
+    def _fail(self, entry, now):
+        if entry.live:
+            self._evict(entry)
+        entry.streak = 0
+        entry.failures += 1
+        if entry.failures >= MAX_FAILURES:
+            del self.entries[(entry.protocol, entry.proxy)]
+            self.counters['forgotten'] += 1
+            return
+        self._reschedule(entry, now + QUARANTINE * 2 ** (entry.failures - 1))
+
+    def record(self, entry, version, result, now=None):
+        """Applies a probe result; ignored if the entry changed while it ran."""
+        now = now or time.time()
+        if self.entries.get((entry.protocol, entry.proxy)) is not entry or entry.version != version:
+            return
+        if not async_checker.is_decided(result):
+            self._reschedule(entry, now + UNDECIDED_RETRY)
+            return
+        self.counters['checks'] += 1
+        entry.checked = round(now)
+        if not result.ok:
+            self._fail(entry, now)
+            return
+        entry.latency = (result.elapsed if entry.latency is None else
+                         LATENCY_SMOOTHING * result.elapsed + (1 - LATENCY_SMOOTHING) * entry.latency)
+        entry.failures = 0
+        entry.streak += 1
+        entry.expires = round(now + min(self.min_ttl * 2 ** (entry.streak - 1), self.max_ttl))
+        self._reschedule(entry, entry.expires)
+        if not entry.live:
+            self._admit(entry)
+
+    def report(self, proxy, protocol=None, now=None):
+        """
+        A client saw `proxy` fail: evicts it at once and re-probes it after
+        the quarantine. Returns the number of entries evicted.
+        """
+        now = now or time.time()
+        evicted = 0
+        for proto in ([protocol] if protocol else PROTOCOLS):
+            entry = self.entries.get((proto, proxy))
+            if entry and entry.live:
+                self.counters['reported'] += 1
+                self._fail(entry, now)
+                evicted += 1
+        return evicted
+
+    def pick(self, protocol=None, strategy='round-robin', now=None):
+        """A live proxy for `protocol` (any protocol if None), or None if there is none."""
+        entry = None
+        if strategy == 'round-robin':
+            rotation = self.rotation[protocol]
+            while rotation:
+                key = rotation.popleft()
+                candidate = self.entries.get(key)
+                if candidate is not None and candidate.live:
+                    rotation.append(key)
+                    entry = candidate
+                    break
+                self.queued[protocol].discard(key)
+        elif strategy == 'lru':
+            recency = self.recency[protocol]
+            if recency:
+                key = next(iter(recency))
+                entry = self.entries[key]
+        elif strategy == 'latency':
+            live = [self.entries[key] for key in self.recency[protocol]]
+            if live:
+                weights = [1 / max(e.latency, MIN_WEIGHT_LATENCY) for e in live]
+                entry = random.choices(live, weights)[0]
+        else:
+            raise ValueError(f"unknown strategy {strategy!r}")
+        if entry is None:
+            return None
+
+        entry.last_used = now or time.time()
+        entry.uses += 1
+        key = (entry.protocol, entry.proxy)
+        for group in (entry.protocol, None):
+            self.recency[group].move_to_end(key)
+        self.counters['served'] += 1
+        return entry
+
+    def stats(self):
+        return {
+            'live': {p: len(self.recency[p]) for p in PROTOCOLS},
+            'tracked': len(self.entries),
+            'due_next': self.next_due(),
+            **self.counters,
+        }
+
+
+class PoolDaemon:
+    """
+    Keeps a ProxyPool fed from the list files proxy_manager.py writes,
+    revalidates it continuously with AsyncLivenessChecker and serves it over
+    a small local HTTP API:
+
+      GET  /proxy?protocol=http&strategy=round-robin|lru|latency
+      POST /report?proxy=1.2.3.4:8080[&protocol=http]
+      GET  /stats
+    """
+
+    def __init__(self, list_dirs, timeout=10, concurrency=200, judges=None,
+                 min_ttl=MIN_TTL, max_ttl=MAX_TTL):
+        self.list_dirs = list_dirs
+        self.pool = ProxyPool(min_ttl, max_ttl)
+        self.checker = async_checker.AsyncLivenessChecker(timeout=timeout, concurrency=concurrency,
+                                                          judges=judges)
+        self.mtimes = {}
+
+    def reload(self):
+        """Tracks endpoints from list files that changed since the last look."""
+        added = 0
+        for directory in self.list_dirs:
+            for proto in PROTOCOLS:
+                path = os.path.join(directory, f"{proto}.txt")
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if self.mtimes.get(path) == mtime:
+                    continue
+                self.mtimes[path] = mtime
+                with open(path, 'r') as f:
+                    added += sum(self.pool.track(line.strip(), proto) for line in f if line.strip())
+        if added:
+            print(f"Tracking {added} new endpoints ({len(self.pool.entries)} in total)")
+
+    async def reloader(self):
+        while True:
+            self.reload()
+            await asyncio.sleep(RELOAD_INTERVAL)
+
+    async def revalidator(self):
+        while True:
+            due = self.pool.pop_due(time.time())
+            if due is None:
+                next_due = self.pool.next_due()
+                await asyncio.sleep(1 if next_due is None else min(max(next_due - time.time(), 0.05), 1))
+                continue
+            entry, version = due
+            result = await self.checker.probe(entry.proxy, entry.protocol)
+            self.pool.record(entry, version, result)
+
+    async def handle_request(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            method, target = head.decode('latin-1').split(' ', 2)[:2]
+            url = urlsplit(target)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            status, payload = self.route(method, url.path, params)
+            body = json.dumps(payload, separators=(',', ':')).encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError,
+                ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    def route(self, method, path, params):
+        protocol = params.get('protocol') or None
+        if protocol is not None and protocol not in PROTOCOLS:
+            return '400 Bad Request', {'error': f"protocol must be one of {PROTOCOLS}"}
+        if path == '/proxy' and method == 'GET':
+            strategy = params.get('strategy', 'round-robin')
+            if strategy not in STRATEGIES:
+                return '400 Bad Request', {'error': f"strategy must be one of {STRATEGIES}"}
+            entry = self.pool.pick(protocol, strategy)
+            if entry is None:
+                return '503 Service Unavailable', {'error': "no live proxy"}
+            return '200 OK', entry.as_dict()
+        if path == '/report' and method == 'POST':
+            if not params.get('proxy'):
+                return '400 Bad Request', {'error': "proxy is required"}
+            return '200 OK', {'evicted': self.pool.report(params['proxy'], protocol)}
+        if path == '/stats' and method == 'GET':
+            return '200 OK', {**self.pool.stats(), 'judges': self.checker.judges.summary()}
+        if path in ('/proxy', '/report', '/stats'):
+            return '405 Method Not Allowed', {'error': f"{method} not allowed on {path}"}
+        return '404 Not Found', {'error': f"no such endpoint {path}"}
+
+    async def run(self, host, port):
+        await self.checker.judges.resolve()
+        server = await asyncio.start_server(self.handle_request, host, port,
+                                            limit=judge.MAX_REQUEST_BYTES, backlog=1024)
+        bound = server.sockets[0].getsockname()
+        print(f"Proxy pool listening on http://{bound[0]}:{bound[1]}/")
+        tasks = [asyncio.create_task(self.reloader())]
+        tasks += [asyncio.create_task(self.revalidator()) for _ in range(self.checker.concurrency)]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve continuously revalidated proxies over a local HTTP API.")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on; use 0.0.0.0 to expose it (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8081, help="port to listen on (default: 8081)")
+    parser.add_argument('--lists', action='append', metavar='DIR',
+                        help="directory with <protocol>.txt lists to take endpoints from, "
+                             "repeatable (default: proxies/active)")
+    parser.add_argument('--timeout', type=float, default=10, help="probe timeout in seconds (default: 10)")
+    parser.add_argument('--concurrency', type=int, default=200, help="checks in flight (default: 200)")
+    parser.add_argument('--min-ttl', type=float, default=MIN_TTL,
+                        help=f"seconds a freshly passed proxy stays live before its recheck (default: {MIN_TTL})")
+    parser.add_argument('--max-ttl', type=float, default=MAX_TTL,
+                        help=f"longest recheck interval for proxies that keep passing (default: {MAX_TTL})")
+    parser.add_argument('--judge', action='append', dest='judges', metavar='URL',
+                        help="http:// judge URL to probe through, repeatable (default: public judges)")
+    args = parser.parse_args()
+
+    daemon = PoolDaemon(args.lists or [os.path.join(BASE_DIR, 'active')], args.timeout,
+                        args.concurrency, args.judges, args.min_ttl, args.max_ttl)
+    try:
+        asyncio.run(daemon.run(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
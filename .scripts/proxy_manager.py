@@ -1,139 +1,1145 @@
 import requests
 import os
+import argparse
+import json
+import re
+import shutil
 import concurrent.futures
+import errno
+import hashlib
+import ipaddress
+import selectors
+import socket
+import threading
+import time
+import zlib
 import pkgutil
+try:
+    import resource
+except ImportError:
+    resource = None
+import queue
 import importlib
 import inspect
 import sources
 from sources.base import ProxySource
+from history import ProxyHistory, is_due
+from proxyset import ProxySet, pack_endpoint, unpack_endpoint
+from manifest import ListManifest, write_atomic
+from scheduler import SourceScheduler
+from iprange import IpRangeIndex
+from blocklist import RangeFilter, learn_subnets, load_rules
+from journal import Checkpointer, ResultJournal
+import async_checker
+import binexport
+import judge
+from metrics import metrics
 
 # Configuration
-BASE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "proxies")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_DIR = os.path.join(ROOT_DIR, "proxies")
 CLEAN_DIR = os.path.join(BASE_DIR, "clean")
 ACTIVE_DIR = os.path.join(BASE_DIR, "active")
+FASTEST_DIR = os.path.join(BASE_DIR, "fastest")
+PROTOCOLS = ['http', 'socks4', 'socks5']
+# Folders under proxies/ written by the manager itself, not by a source
+OUTPUT_DIRS = ['clean', 'active', 'fastest', 'by-country', 'by-asn']
+# Size of the per-protocol proxies/fastest/ tier
+FASTEST_TIER_SIZE = 100
 
-def save_proxies_from_source(source_name, proxies_dict):
-    """Saves a dict of proxies to proxies/<source_name>/<protocol>.txt"""
-    directory = os.path.join(BASE_DIR, source_name)
-    
-    # Clear directory first
-    if os.path.exists(directory):
-        for f in os.listdir(directory):
-            os.remove(os.path.join(directory, f))
-    os.makedirs(directory, exist_ok=True)
-    
+# Modules in sources/ that hold shared base classes rather than a source
+SOURCE_HELPER_MODULES = ['base', 'client', 'paginated']
+
+# Local run state kept between runs (not committed, cached by the workflow)
+STATE_DIR = os.path.join(ROOT_DIR, ".state")
+HISTORY_FILE = os.path.join(STATE_DIR, "history.sqlite")
+# Per-shard check results waiting to be merged into proxies/active/
+SHARDS_DIR = os.path.join(STATE_DIR, "shards")
+# Results journals of check runs still in progress, see journal.py
+JOURNAL_DIR = os.path.join(STATE_DIR, "journal")
+# JSON run reports and Prometheus textfiles (see metrics.py)
+METRICS_DIR = os.path.join(STATE_DIR, "metrics")
+# Per-source fetch cost and yield deciding which sources to fetch, see scheduler.py
+SOURCE_STATS_FILE = os.path.join(STATE_DIR, "sources.json")
+# CIDR/port rules for endpoints that are never open proxies, see blocklist.py
+BLOCKLIST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blocklist.txt")
+# Offline IP -> country/ASN index built by `iprange.py compile`
+IP_INDEX_FILE = os.path.join(STATE_DIR, "ipranges.idx")
+# Per-source metadata (country, ASN) as reported by the source's API
+SOURCE_METADATA_FILE = "metadata.jsonl"
+
+# Liveness engines: 'async' speaks the proxy protocols itself on raw sockets,
+# 'threads' is the original blocking requests-based checker.
+ENGINES = ['async', 'threads']
+DEFAULT_TIMEOUTS = {'async': 10, 'threads': 30}
+DEFAULT_CONCURRENCY = {'async': 1000, 'threads': 50}
+
+# Judges the threaded engine asks per proxy; the pool spreads them over
+# judge.DEFAULT_JUDGES (or --judge), two still cover one judge being down.
+JUDGE_ATTEMPTS = 2
+
+# Concurrency is capped so every probe fits in the open file limit: the
+# async engine races CONNECT and forward mode on two sockets per HTTP
+# proxy, detection probes the remaining protocols of an endpoint at once
+# and the threaded engine races JUDGE_ATTEMPTS judges. FD_RESERVE
+# descriptors stay free for everything else (history, lists, pipes).
+FDS_PER_PROBE = {'async': 2, 'threads': JUDGE_ATTEMPTS, 'detect': len(async_checker.DETECT_ORDER)}
+FD_RESERVE = 64
+# Soft limit asked for when the hard limit is unlimited
+MAX_FD_LIMIT = 65536
+
+# Hard wall-clock limit per protocol check phase; probes still running when
+# it expires are cancelled and the results gathered so far are saved.
+PHASE_DEADLINE = 20 * 60
+
+# TCP pre-filter: a bare connect() with a short timeout weeds out the hosts
+# that never answer before any engine spends a full protocol check on them.
+PREFILTER_TIMEOUT = 3
+PREFILTER_BATCH = 1000
+
+def raise_fd_limit():
+    """Raises the soft open file limit as far as the hard limit allows."""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = MAX_FD_LIMIT if hard == resource.RLIM_INFINITY else hard
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+        except (ValueError, OSError):
+            # macOS refuses soft limits above its own cap even under an unlimited hard limit
+            pass
+
+def fd_budget():
+    """Descriptors free for probe sockets under the soft open file limit; None if unbounded."""
+    if resource is None:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return max(soft - FD_RESERVE, 1)
+
+def fit_concurrency(concurrency, engine):
+    """`concurrency` capped so that many probes of `engine` fit the open file limit."""
+    budget = fd_budget()
+    if budget is None:
+        return concurrency
+    fitting = max(budget // FDS_PER_PROBE[engine], 1)
+    if concurrency > fitting:
+        print(f"Concurrency capped at {fitting} to fit the open file limit")
+        return fitting
+    return concurrency
+
+def save_proxies_from_source(source_name, proxies_dict, metadata=None):
+    """
+    Saves a dict of proxies to proxies/<source_name>/<protocol>.txt and
+    returns the de-duplicated {protocol: ProxySet} that was written. Files
+    are only rewritten when their content changed; protocols the source no
+    longer lists are removed. `metadata` ({proxy: {'country', 'asn'}}) goes
+    to proxies/<source_name>/metadata.jsonl.
+    """
+    manifest = ListManifest(BASE_DIR)
     total_count = 0
-    for protocol, proxy_list in proxies_dict.items():
-        if not proxy_list:
-            continue
-            
+    changed = 0
+    proxy_sets = {}
+    for protocol in PROTOCOLS:
+        key = f"{source_name}/{protocol}"
+
         # Remove duplicates within the list
-        unique_proxies = list(set(proxy_list))
-        
-        filename = os.path.join(directory, f"{protocol}.txt")
-        with open(filename, 'w') as f:
-            f.write('\n'.join(unique_proxies) + '\n')
-        
+        unique_proxies = ProxySet.from_lines(proxies_dict.get(protocol) or [])
+        if unique_proxies.rejected:
+            print(f"  Skipped {unique_proxies.rejected} malformed {protocol} entries from {source_name}")
+        if not unique_proxies:
+            manifest.remove_list(key)
+            continue
+
+        changed += manifest.write_list(key, unique_proxies)
+        proxy_sets[protocol] = unique_proxies
         total_count += len(unique_proxies)
-        
-    print(f"  Saved {total_count} proxies from {source_name}")
 
-def deduplicate_proxies():
-    print("\nDeduplicating proxies...")
-    os.makedirs(CLEAN_DIR, exist_ok=True)
-    
-    # Clear clean dir
-    for f in os.listdir(CLEAN_DIR):
-        os.remove(os.path.join(CLEAN_DIR, f))
-    
-    for proto in ['http', 'socks4', 'socks5']:
-        all_proxies = set()
-        
-        # Walk through all source folders
-        for source in os.listdir(BASE_DIR):
-            source_path = os.path.join(BASE_DIR, source)
-            # Skip clean, active, and any non-directory
-            if not os.path.isdir(source_path) or source in ['clean', 'active']:
-                continue
-                
+    manifest.save()
+    if metadata:
+        save_source_metadata(source_name, metadata, proxy_sets)
+    print(f"  Saved {total_count} proxies from {source_name} ({changed} lists changed)")
+    return proxy_sets
+
+def save_source_metadata(source_name, metadata, proxy_sets):
+    listed = ProxySet.union_all(proxy_sets.values())
+    data = ''.join(json.dumps({'proxy': proxy, **metadata[proxy]}) + '\n'
+                   for proxy in sorted(metadata) if proxy in listed).encode()
+    path = os.path.join(BASE_DIR, source_name, SOURCE_METADATA_FILE)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, data)
+
+def load_source_metadata():
+    """{proxy: {'country', 'asn'}} from every source folder's metadata.jsonl."""
+    metadata = {}
+    for source in os.listdir(BASE_DIR) if os.path.isdir(BASE_DIR) else []:
+        path = os.path.join(BASE_DIR, source, SOURCE_METADATA_FILE)
+        if source in OUTPUT_DIRS or not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    metadata[entry.pop('proxy')] = entry
+    return metadata
+
+def load_source_sets(source_sets=None):
+    """
+    Collects {source: {protocol: ProxySet}} for every source folder, using the
+    in-memory sets from this run where available and reading each remaining
+    file exactly once.
+    """
+    collected = dict(source_sets or {})
+    for source in os.listdir(BASE_DIR):
+        source_path = os.path.join(BASE_DIR, source)
+        # Skip clean, active, and any non-directory
+        if not os.path.isdir(source_path) or source in OUTPUT_DIRS or source in collected:
+            continue
+
+        collected[source] = {}
+        for proto in PROTOCOLS:
             file_path = os.path.join(source_path, f"{proto}.txt")
             if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    for line in f:
-                        p = line.strip()
-                        if p: all_proxies.add(p)
-        
-        if all_proxies:
-            clean_file = os.path.join(CLEAN_DIR, f"{proto}.txt")
-            with open(clean_file, 'w') as f:
-                f.write('\n'.join(all_proxies) + '\n')
-            print(f"Saved {len(all_proxies)} unique {proto} proxies to {clean_file}")
+                collected[source][proto] = ProxySet.from_file(file_path)
+    return collected
 
-def check_single_proxy(proxy, protocol, timeout):
-    test_urls = [
-        'http://httpbin.org/ip',
-        'https://api.ipify.org?format=json',
-        'https://ifconfig.me/ip'
-    ]
+def load_blocklist(path):
+    blocklist = RangeFilter(load_rules(path))
+    print(f"Blocklist: {blocklist.rules} rules from {path}")
+    return blocklist
+
+def suppressed_subnets(rows):
+    """RangeFilter of the subnets history says never validate, see blocklist.learn_subnets()."""
+    return RangeFilter(learn_subnets(rows))
+
+def deduplicate_proxies(source_sets=None, scheduler=None, blocklist=None):
+    """
+    Merges every source's lists into clean/<protocol>.txt, leaving out the
+    endpoints the `blocklist` RangeFilter covers. Returns {protocol: ProxySet}.
+    """
+    print("\nDeduplicating proxies...")
+    manifest = ListManifest(BASE_DIR)
+    collected = load_source_sets(source_sets)
+    if scheduler:
+        scheduler.record_overlap(collected)
+    clean_sets = {}
+    for proto in PROTOCOLS:
+        with metrics.span('dedup', protocol=proto):
+            inputs = [sets[proto] for sets in collected.values() if sets.get(proto)]
+            all_proxies = ProxySet.union_all(inputs)
+            blocked = 0
+            if blocklist:
+                all_proxies, blocked = blocklist.split(all_proxies)
+        metrics.inc('proxy_blocklist_dropped_total', blocked, protocol=proto, kind='static')
+        metrics.set('proxy_dedup_input_proxies', sum(len(p) for p in inputs), protocol=proto)
+        metrics.set('proxy_dedup_output_proxies', len(all_proxies), protocol=proto)
+
+        key = f"clean/{proto}"
+        if not all_proxies:
+            manifest.remove_list(key)
+            if blocked:
+                print(f"No {proto} proxies left after dropping {blocked} blocklisted ones")
+            continue
+        manifest.write_list(key, all_proxies)
+        clean_sets[proto] = all_proxies
+        entry = manifest.lists[key]
+        clean_file = os.path.join(CLEAN_DIR, f"{proto}.txt")
+        print(f"Saved {len(all_proxies)} unique {proto} proxies to {clean_file} "
+              f"(+{entry['added']}/-{entry['removed']}, {blocked} blocklisted)")
+    manifest.save()
+    return clean_sets
+
+def probe_judge(pool, proxies, timeout, exclude=None):
+    """
+    Asks one judge from `pool` through `proxies`. Returns (judge, ttfb,
+    exit_ip, fault) where ttfb, the seconds until the response headers, is
+    None on failure, including a 200 whose body names no exit IP, and
+    `fault` tells whether the failure was the judge's.
+    """
+    target = pool.acquire(exclude=exclude)
+    fault = None
+    try:
+        resp = requests.get(target.url, proxies=proxies, timeout=timeout)
+        # https judges are reached through a CONNECT tunnel, so their errors are their own
+        tunneled = target.scheme == 'https'
+        if resp.status_code == 200:
+            exit_ip = judge.parse_exit_ip(resp.content[:judge.MAX_BODY_BYTES])
+            if exit_ip is not None:
+                fault = False
+                return target, resp.elapsed.total_seconds(), exit_ip, fault
+            # Any web server answers 200 to a forwarded GET; only a judge's body proves a proxy
+            fault = tunneled
+        else:
+            fault = tunneled or resp.status_code in judge.JUDGE_FAULT_STATUSES
+    except Exception:
+        pass
+    finally:
+        pool.release(target, fault)
+    return target, None, None, bool(fault)
+
+def measure_single_proxy(proxy, protocol, timeout, race_executor=None, pool=None):
+    """
+    Blocking requests-based check; returns a ProbeResult. requests does not
+    expose the connect time, only the time until response headers (ttfb).
+    Up to JUDGE_ATTEMPTS judges from `pool` are asked: with a
+    `race_executor` at once with the first 200 winning, otherwise one after
+    another.
+    """
+    pool = pool or judge.JudgePool()
     proxies = {
         'http': f'{protocol}://{proxy}',
         'https': f'{protocol}://{proxy}'
     }
-    for url in test_urls:
-        try:
-            resp = requests.get(url, proxies=proxies, timeout=timeout)
-            if resp.status_code == 200:
-                return proxy
-        except Exception:
-            continue
-    return None
+    attempts = min(JUDGE_ATTEMPTS, len(pool.judges))
+    start = time.monotonic()
+    faults = 0
+    if race_executor is None:
+        tried = None
+        for _ in range(attempts):
+            attempt = time.monotonic()
+            tried, ttfb, exit_ip, fault = probe_judge(pool, proxies, timeout, exclude=tried)
+            faults += fault
+            if ttfb is not None:
+                return async_checker.ProbeResult(proxy, protocol, True, time.monotonic() - start,
+                                                 None, None, attempt - start + ttfb, exit_ip)
+    else:
+        futures = [race_executor.submit(probe_judge, pool, proxies, timeout) for _ in range(attempts)]
+        for future in concurrent.futures.as_completed(futures):
+            _, ttfb, exit_ip, fault = future.result()
+            faults += fault
+            if ttfb is not None:
+                for other in futures:
+                    other.cancel()
+                return async_checker.ProbeResult(proxy, protocol, True, time.monotonic() - start,
+                                                 None, None, ttfb, exit_ip)
+    # Only judges failing says nothing about the proxy
+    error = 'judge' if attempts and faults == attempts else 'failed'
+    return async_checker.ProbeResult(proxy, protocol, False, time.monotonic() - start, error)
 
-def check_proxies_liveness():
-    print("\nChecking proxies liveness...")
-    os.makedirs(ACTIVE_DIR, exist_ok=True)
-    
-    timeout = 30
-    max_workers = 50
-    
-    print(f"Settings: Timeout={timeout}s, Workers={max_workers}")
-    
-    for proto in ['http', 'socks4', 'socks5']:
+def check_single_proxy(proxy, protocol, timeout):
+    return proxy if measure_single_proxy(proxy, protocol, timeout).ok else None
+
+def connect_batch(batch, timeout):
+    """
+    Starts non-blocking connects for a batch and returns (endpoints that
+    completed, number of endpoints tried). Running out of descriptors ends
+    the batch early; the untried rest is left to the caller.
+    """
+    selector = selectors.DefaultSelector()
+    reachable = set()
+    tried = 0
+    try:
+        for proxy in batch:
+            host, _, port = proxy.rpartition(':')
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            except OSError as e:
+                if e.errno not in (errno.EMFILE, errno.ENFILE) or not tried:
+                    raise
+                break
+            tried += 1
+            sock.setblocking(False)
+            try:
+                err = sock.connect_ex((host, int(port)))
+            except (ValueError, OverflowError):
+                err = errno.EINVAL
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sock.close()
+                continue
+            selector.register(sock, selectors.EVENT_WRITE, proxy)
+
+        deadline = time.monotonic() + timeout
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                sock = key.fileobj
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    reachable.add(key.data)
+                selector.unregister(sock)
+                sock.close()
+    finally:
+        for key in list(selector.get_map().values()):
+            selector.unregister(key.fileobj)
+            key.fileobj.close()
+        selector.close()
+    return reachable, tried
+
+def is_ipv4_endpoint(proxy):
+    try:
+        ipaddress.IPv4Address(proxy.rpartition(':')[0])
+        return True
+    except ValueError:
+        return False
+
+def tcp_prefilter(proxies, timeout=PREFILTER_TIMEOUT, batch_size=PREFILTER_BATCH):
+    """
+    Returns the proxies that accept a TCP connection within `timeout`, in
+    their original order. Entries that are not ip:port literals are passed
+    through untouched so the full check can still decide on them.
+    """
+    start = time.monotonic()
+    candidates = []
+    reachable = set()
+    for p in proxies:
+        if is_ipv4_endpoint(p):
+            candidates.append(p)
+        else:
+            reachable.add(p)
+
+    budget = fd_budget()
+    if budget is not None:
+        batch_size = min(batch_size, budget)
+    i = 0
+    while i < len(candidates):
+        batch_reachable, tried = connect_batch(candidates[i:i + batch_size], timeout)
+        reachable |= batch_reachable
+        i += tried
+
+    kept = [p for p in proxies if p in reachable]
+    dropped = len(proxies) - len(kept)
+    print(f"  Pre-filter: {len(kept)}/{len(proxies)} accepted TCP, "
+          f"dropped {dropped} in {time.monotonic() - start:.1f}s")
+    return kept
+
+class DaemonExecutor(concurrent.futures.Executor):
+    """
+    Thread pool whose workers are daemon threads. requests only bounds each
+    read, so a proxy trickling bytes can hold a probe forever, and the
+    interpreter joins ThreadPoolExecutor workers at exit; probes a phase
+    deadline gave up on are simply left behind here.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.work = queue.SimpleQueue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        self.work.put((future, fn, args, kwargs))
+        with self.lock:
+            if len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        return future
+
+    def _worker(self):
+        while True:
+            item = self.work.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        if cancel_futures:
+            while True:
+                try:
+                    item = self.work.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+        with self.lock:
+            threads = list(self.threads)
+        for _ in threads:
+            self.work.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+def check_with_threads(proxies, proto, timeout, max_workers, adaptive=True, deadline=None,
+                       judges=None, on_result=None):
+    results = []
+    adaptive_timeout = async_checker.AdaptiveTimeout(timeout) if adaptive else None
+    pool = judge.JudgePool(judges)
+    executor = DaemonExecutor(max_workers)
+    race_executor = DaemonExecutor(max_workers * JUDGE_ATTEMPTS)
+
+    def run(proxy):
+        current = adaptive_timeout.current() if adaptive_timeout else timeout
+        with metrics.in_flight():
+            result = measure_single_proxy(proxy, proto, current, race_executor, pool)
+        if adaptive_timeout:
+            adaptive_timeout.observe(result)
+        return result
+
+    try:
+        future_to_proxy = {executor.submit(run, p): p for p in proxies}
+
+        completed = 0
+        total = len(proxies)
+        for future in concurrent.futures.as_completed(future_to_proxy, timeout=deadline):
+            completed += 1
+            if completed % 50 == 0:
+                print(f"  Checked {completed}/{total} {proto} proxies...")
+
+            results.append(future.result())
+            if on_result:
+                on_result(results[-1])
+    except concurrent.futures.TimeoutError:
+        print(f"  {proto} phase deadline of {deadline}s reached, "
+              f"{total - completed} proxies left undecided")
+    finally:
+        # Queued probes are dropped; running ones are abandoned to their daemon threads
+        executor.shutdown(wait=False, cancel_futures=True)
+        race_executor.shutdown(wait=False, cancel_futures=True)
+    print(f"  Judges: {pool.summary()}")
+    return results
+
+def check_with_asyncio(proxies, proto, timeout, concurrency, adaptive=True, deadline=None,
+                       judges=None, on_result=None):
+    total = len(proxies)
+    completed = 0
+
+    def progress(result):
+        nonlocal completed
+        completed += 1
+        if completed % 1000 == 0:
+            print(f"  Checked {completed}/{total} {proto} proxies...")
+        if on_result:
+            on_result(result)
+
+    return async_checker.check_proxies(proxies, proto, timeout=timeout,
+                                       concurrency=concurrency, on_result=progress,
+                                       adaptive=adaptive, deadline=deadline, judges=judges)
+
+def millis(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+def save_active_proxies(proto, results, fastest=FASTEST_TIER_SIZE, enrichment=None):
+    """
+    Writes the working proxies among `results` fastest first to
+    active/<proto>.txt, their timings (and country/ASN from `enrichment`,
+    see enrich_endpoints()) to active/<proto>.jsonl and the `fastest`
+    quickest ones to fastest/<proto>.txt.
+    """
+    enrichment = enrichment or {}
+    working = sorted((r for r in results if r.ok), key=lambda r: (r.elapsed, r.proxy))
+    metrics.set('proxy_active_proxies', len(working), protocol=proto)
+    active_file = os.path.join(ACTIVE_DIR, f"{proto}.txt")
+    if working:
+        # Speed order is the point of these lists, so unlike source and
+        # clean lists they are not in address order; deltas are still
+        # counted as sets, so re-ranking alone is not reported as churn
+        manifest = ListManifest(BASE_DIR)
+        manifest.write_list(f"active/{proto}", (r.proxy for r in working))
+        write_atomic(os.path.join(ACTIVE_DIR, f"{proto}.jsonl"), ''.join(
+            json.dumps({
+                'proxy': r.proxy,
+                'connect_ms': millis(r.connect),
+                'ttfb_ms': millis(r.ttfb),
+                'total_ms': millis(r.elapsed),
+                'exit_ip': r.exit_ip,
+                'country': enrichment.get(r.proxy, (None, None))[0],
+                'asn': enrichment.get(r.proxy, (None, None))[1],
+            }) + '\n' for r in working).encode())
+        if fastest:
+            manifest.write_list(f"fastest/{proto}", (r.proxy for r in working[:fastest]))
+        manifest.save()
+        print(f"Saved {len(working)} active {proto} proxies to {active_file} "
+              f"(median {millis(working[len(working) // 2].elapsed)} ms)")
+    else:
+        # Last run's lists would otherwise keep being served (and counted)
+        manifest = ListManifest(BASE_DIR)
+        manifest.remove_list(f"active/{proto}")
+        manifest.remove_list(f"fastest/{proto}")
+        manifest.save()
+        jsonl_file = os.path.join(ACTIVE_DIR, f"{proto}.jsonl")
+        if os.path.exists(jsonl_file):
+            os.remove(jsonl_file)
+        print(f"No active {proto} proxies found.")
+
+def enrich_endpoints(results, ip_index_path=None):
+    """
+    {proxy: (country, asn)} for the working proxies in `results`
+    ({protocol: [ProbeResult, ...]}): looked up in the offline index at
+    `ip_index_path` if there is one, filled in from what the sources
+    reported where the index has no answer.
+    """
+    working = ProxySet.from_lines(r.proxy for proto_results in results.values()
+                                  for r in proto_results if r.ok)
+    with metrics.span('enrich'):
+        enrichment = {}
+        if ip_index_path and os.path.exists(ip_index_path):
+            with IpRangeIndex(ip_index_path) as index:
+                enrichment = index.lookup_endpoints(working)
+        reported = load_source_metadata()
+        for proxy in working:
+            country, asn = enrichment.get(proxy, (None, None))
+            if (country is None or asn is None) and proxy in reported:
+                country = country or reported[proxy].get('country')
+                asn = asn or reported[proxy].get('asn')
+            enrichment[proxy] = (country, asn)
+    known = sum(1 for country, asn in enrichment.values() if country or asn)
+    print(f"Enriched {known} of {len(working)} working proxies with country/ASN")
+    return enrichment
+
+def save_grouped_lists(results, enrichment):
+    """
+    Writes by-country/<CC>/<proto>.txt and by-asn/AS<n>/<proto>.txt next to
+    active/, fastest first, and removes the groups that have no working
+    proxies left.
+    """
+    manifest = ListManifest(BASE_DIR)
+    written = set()
+    for proto, proto_results in results.items():
+        working = sorted((r for r in proto_results if r.ok), key=lambda r: (r.elapsed, r.proxy))
+        groups = {}
+        for r in working:
+            country, asn = enrichment.get(r.proxy, (None, None))
+            if country:
+                groups.setdefault(f"by-country/{country}/{proto}", []).append(r.proxy)
+            if asn:
+                groups.setdefault(f"by-asn/AS{asn}/{proto}", []).append(r.proxy)
+        for key, proxies in groups.items():
+            manifest.write_list(key, proxies)
+            written.add(key)
+    for key in [k for k in manifest.lists if k.split('/')[0] in ('by-country', 'by-asn')]:
+        if key not in written and key.rsplit('/', 1)[1] in results:
+            manifest.remove_list(key)
+            try:
+                os.rmdir(os.path.dirname(os.path.join(BASE_DIR, key)))
+            except OSError:
+                pass
+    manifest.save()
+    countries = {k.split('/')[1] for k in written if k.startswith('by-country/')}
+    asns = {k.split('/')[1] for k in written if k.startswith('by-asn/')}
+    print(f"Saved active lists for {len(countries)} countries and {len(asns)} ASNs")
+
+def save_active_lists(results, fastest=FASTEST_TIER_SIZE, ip_index_path=None, history=None):
+    """
+    save_active_proxies() for every protocol in `results`, plus the
+    per-country and per-ASN lists and the binary exports.
+    """
+    enrichment = enrich_endpoints(results, ip_index_path)
+    for proto, proto_results in results.items():
+        save_active_proxies(proto, proto_results, fastest, enrichment)
+    save_grouped_lists(results, enrichment)
+    save_binary_exports(results, history)
+
+def save_binary_exports(results, history=None):
+    """
+    proxies/active.bin and proxies/clean.bin (see binexport.py): active/
+    and clean/ as fixed-width records clients can memory-map instead of
+    parsing text. Active entries were seen working now; clean ones carry
+    the latency and last success `history` (a ProxyHistory) has for them.
+    """
+    now = time.time()
+    active, clean = {}, {}
+    for proto in PROTOCOLS:
+        working = sorted((r for r in results.get(proto, ()) if r.ok), key=lambda r: (r.elapsed, r.proxy))
+        active[proto] = [(r.proxy, r.elapsed, now) for r in working]
         clean_file = os.path.join(CLEAN_DIR, f"{proto}.txt")
         if not os.path.exists(clean_file):
+            clean[proto] = []
             continue
-            
-        print(f"Checking {proto} proxies...")
-        with open(clean_file, 'r') as f:
-            proxies = [line.strip() for line in f if line.strip()]
-            
-        working = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_proxy = {executor.submit(check_single_proxy, p, proto, timeout): p for p in proxies}
-            
-            completed = 0
-            total = len(proxies)
-            for future in concurrent.futures.as_completed(future_to_proxy):
-                completed += 1
-                if completed % 50 == 0:
-                    print(f"  Checked {completed}/{total} {proto} proxies...")
-                    
-                result = future.result()
-                if result:
-                    working.append(result)
-        
-        if working:
-            active_file = os.path.join(ACTIVE_DIR, f"{proto}.txt")
-            with open(active_file, 'w') as f:
-                f.write('\n'.join(working) + '\n')
-            print(f"Saved {len(working)} active {proto} proxies to {active_file}")
+        rows = history.load(proto) if history else {}
+        clean[proto] = []
+        for proxy in ProxySet.from_file(clean_file):
+            _, last_success, _, latency = rows.get(proxy, (None, None, None, None))
+            clean[proto].append((proxy, latency, last_success))
+    for name, sections in (('active', active), ('clean', clean)):
+        path = os.path.join(BASE_DIR, f"{name}.bin")
+        if binexport.write_export(path, sections):
+            print(f"Saved {sum(len(e) for e in sections.values())} {name} proxies to {path}")
+
+def record_check_metrics(proto, results, started):
+    """Outcome counts and throughput of a check phase that began at `started` (monotonic)."""
+    seconds = time.monotonic() - started
+    metrics.add_span('check', started, seconds, protocol=proto)
+    outcomes = {}
+    for r in results:
+        outcome = 'ok' if r.ok else r.error or 'failed'
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    for outcome, count in outcomes.items():
+        metrics.inc('proxy_checks_total', count, protocol=proto, outcome=outcome)
+    if seconds > 0:
+        metrics.set('proxy_checks_per_second', round(len(results) / seconds, 1), protocol=proto)
+
+def check_proxies_liveness(engine='async', timeout=None, concurrency=None,
+                           prefilter=True, prefilter_timeout=PREFILTER_TIMEOUT,
+                           history_path=HISTORY_FILE, fastest=FASTEST_TIER_SIZE,
+                           adaptive=True, phase_deadline=PHASE_DEADLINE, shard=None,
+                           judges=None, detect=False, source_stats_path=None,
+                           ip_index_path=None, suppress=True, journal_dir=None):
+    """
+    Checks proxies/clean/ and saves active/ using the judge URLs in `judges`
+    (default judge.DEFAULT_JUDGES). With `detect` (async engine) every
+    endpoint is probed once across all lists, see detect_endpoints(). With `shard` = (index, count)
+    only that shard's endpoints are checked and every decided result goes to
+    a shard file instead; merge_shards() later turns those into active/ and
+    records them in the history. With `suppress`, subnets the history says
+    never validate are skipped. Each source's yield is recorded in
+    `source_stats_path` if given; working proxies are annotated with
+    country/ASN from `ip_index_path`. With `journal_dir`, results are
+    journaled as they arrive and partial lists flushed every
+    CHECKPOINT_INTERVAL, and a killed run restarted over the same clean
+    lists resumes where it stopped. Returns {protocol: [ProbeResult, ...]}.
+    """
+    print("\nChecking proxies liveness..." + (f" (shard {shard[0]}/{shard[1]})" if shard else ""))
+    os.makedirs(ACTIVE_DIR, exist_ok=True)
+    history = ProxyHistory(history_path) if history_path else None
+
+    timeout = timeout or DEFAULT_TIMEOUTS[engine]
+    concurrency = fit_concurrency(concurrency or DEFAULT_CONCURRENCY[engine],
+                                  'detect' if detect else engine)
+
+    print(f"Settings: Engine={engine}, Timeout={timeout}s{' (adaptive)' if adaptive else ''}, "
+          f"Concurrency={concurrency}, Deadline={phase_deadline}s/protocol, "
+          f"Pre-filter={f'{prefilter_timeout}s' if prefilter else 'off'}"
+          + (", Detect=on" if detect else ""))
+
+    planned = {}
+    for proto in PROTOCOLS:
+        proxies = plan_checks(proto, history, shard, suppress)
+        if proxies is not None:
+            planned[proto] = proxies
+
+    journal = open_journal(journal_dir, shard, detect) if journal_dir else None
+    prior = resumed_results(planned, journal)
+    remaining = skip_decided(planned, journal, detect)
+
+    def flush(proto, results):
+        # Partial lists of a phase still running, so a killed run leaves something behind
+        if shard:
+            save_shard_results(proto, merge_results(prior.get(proto, []), results), shard)
         else:
-            print(f"No active {proto} proxies found.")
+            save_active_proxies(proto, merge_results(prior.get(proto, []), results), fastest)
+
+    if detect:
+        def flush_detected(results):
+            for proto in PROTOCOLS:
+                listed = set(planned.get(proto, ()))
+                mine = [r for r in results if r.protocol == proto and (r.ok or r.proxy in listed)]
+                if mine or prior.get(proto):
+                    flush(proto, mine)
+        checkpoint = Checkpointer(journal, flush_detected) if journal is not None else None
+        outcomes = detect_endpoints(remaining, timeout, concurrency, prefilter, prefilter_timeout,
+                                    adaptive, phase_deadline * len(remaining), judges, checkpoint)
+        if journal is not None:
+            journal.append(r for _, dropped in outcomes.values() for r in dropped)
+    else:
+        outcomes = {}
+        for proto, proxies in remaining.items():
+            print(f"Checking {proto} proxies...")
+            candidates = proxies
+            if prefilter:
+                candidates = prefilter_phase(proxies, prefilter_timeout, proto)
+            dropped = prefilter_dropped(proxies, candidates, proto)
+            checkpoint = None
+            if journal is not None:
+                journal.append(dropped)
+                checkpoint = Checkpointer(journal, lambda results, proto=proto: flush(proto, results))
+
+            started = time.monotonic()
+            if engine == 'threads':
+                results = check_with_threads(candidates, proto, timeout, concurrency,
+                                             adaptive, phase_deadline, judges, checkpoint)
+            else:
+                results = check_with_asyncio(candidates, proto, timeout, concurrency,
+                                             adaptive, phase_deadline, judges, checkpoint)
+            record_check_metrics(proto, results, started)
+            outcomes[proto] = (results, dropped)
+
+    all_results = {}
+    for proto, (results, dropped) in outcomes.items():
+        all_results[proto] = merge_results(prior.get(proto, []), results + dropped)
+        if shard:
+            save_shard_results(proto, all_results[proto], shard)
+            continue
+
+        if history:
+            history.record(all_results[proto], proto)
+
+    if not shard:
+        save_active_lists(all_results, fastest, ip_index_path, history)
+    if source_stats_path and not shard:
+        record_source_yields(SourceScheduler(source_stats_path), all_results)
+    if history and shard:
+        history.close()
+    elif history:
+        forgotten = history.prune()
+        if forgotten:
+            print(f"History: forgot {forgotten} proxies no longer listed by any source")
+        history.close()
+    if journal is not None:
+        journal.close(finished=True)
+    return all_results
+
+def open_journal(journal_dir, shard=None, detect=False):
+    """
+    The results journal of this check run. It is tied to the shard, the
+    mode and the content of the clean lists, so it only resumes a run that
+    was checking exactly the same thing.
+    """
+    name = f"shard-{shard[0]}-of-{shard[1]}" if shard else "check"
+    clean = {}
+    for proto in PROTOCOLS:
+        clean_file = os.path.join(CLEAN_DIR, f"{proto}.txt")
+        if os.path.exists(clean_file):
+            with open(clean_file, 'rb') as f:
+                clean[proto] = hashlib.sha256(f.read()).hexdigest()
+    journal = ResultJournal(os.path.join(journal_dir, f"{name}.jsonl"),
+                            {'shard': list(shard) if shard else None, 'detect': detect, 'clean': clean})
+    if len(journal):
+        print(f"Resuming from {journal.path}: {len(journal)} results already decided")
+    return journal
+
+def resumed_results(planned, journal):
+    """{protocol: [ProbeResult, ...]} an earlier attempt decided, as its check phase would have returned them."""
+    if journal is None:
+        return {}
+    prior = {}
+    for proto in PROTOCOLS:
+        listed = set(planned.get(proto, ()))
+        # Protocol detection also files working endpoints under protocols they were not listed for
+        prior[proto] = [r for r in journal.decided(proto).values() if r.ok or r.proxy in listed]
+    return prior
+
+def skip_decided(planned, journal, detect=False):
+    """`planned` without the endpoints `journal` already has results for."""
+    if journal is None or not len(journal):
+        return planned
+    if detect:
+        # An endpoint is done once every protocol has been tried on it
+        done = set.intersection(*(set(journal.decided(p)) for p in async_checker.DETECT_ORDER))
+        return {proto: [p for p in proxies if p not in done] for proto, proxies in planned.items()}
+    return {proto: [p for p in proxies if p not in journal.decided(proto)]
+            for proto, proxies in planned.items()}
+
+def merge_results(earlier, later):
+    """Results of both lists, one per proxy, `later` winning."""
+    merged = {r.proxy: r for r in earlier}
+    merged.update((r.proxy, r) for r in later)
+    return list(merged.values())
+
+def plan_checks(proto, history=None, shard=None, suppress=True):
+    """
+    The proxies of clean/<proto>.txt due for a check, in check order; None
+    if there is no list. With `suppress`, endpoints in subnets the history
+    says never validate are left out too.
+    """
+    clean_file = os.path.join(CLEAN_DIR, f"{proto}.txt")
+    if not os.path.exists(clean_file):
+        return None
+    with open(clean_file, 'r') as f:
+        proxies = [line.strip() for line in f if line.strip()]
+
+    if shard:
+        proxies = [p for p in proxies if shard_of(p, shard[1]) == shard[0]]
+
+    if history:
+        proxies, skipped = history.plan(proxies, proto)
+        suppressed = 0
+        if suppress:
+            subnets = suppressed_subnets(history.load(proto))
+            if subnets:
+                planned = len(proxies)
+                proxies = [p for p in proxies if not subnets.matches_proxy(p)]
+                suppressed = planned - len(proxies)
+                metrics.inc('proxy_blocklist_dropped_total', suppressed, protocol=proto, kind='learned')
+        print(f"  {proto} history: checking {len(proxies)}, skipping {len(skipped)} in backoff"
+              + (f" and {suppressed} in suppressed subnets" if suppressed else ""))
+    return proxies
+
+def prefilter_phase(proxies, prefilter_timeout, label):
+    with metrics.span('prefilter', protocol=label):
+        candidates = tcp_prefilter(proxies, timeout=prefilter_timeout)
+    metrics.inc('proxy_prefilter_dropped_total', len(proxies) - len(candidates), protocol=label)
+    return candidates
+
+def prefilter_dropped(proxies, candidates, proto):
+    # Endpoints dropped by the pre-filter count as failed checks too;
+    # ones a deadline left unchecked are not recorded at all
+    reached = set(candidates)
+    return [async_checker.ProbeResult(p, proto, False, None, 'prefilter')
+            for p in proxies if p not in reached]
+
+def detect_endpoints(planned, timeout, concurrency, prefilter=True,
+                     prefilter_timeout=PREFILTER_TIMEOUT, adaptive=True, deadline=None,
+                     judges=None, on_result=None):
+    """
+    Cross-protocol check: the per-protocol lists in `planned` are merged
+    into one set of endpoints, each pre-filtered and probed once with
+    async_checker.detect_protocols(), and filed under every protocol it
+    actually speaks, whichever list it came from. Returns
+    {protocol: (results, dropped)}; results only cover the endpoints
+    listed under that protocol plus the ones found to work with it.
+    """
+    listed = {proto: set(proxies) for proto, proxies in planned.items()}
+    endpoints = list(dict.fromkeys(p for proxies in planned.values() for p in proxies))
+    print(f"Detecting protocols: {sum(len(p) for p in planned.values())} listed entries "
+          f"are {len(endpoints)} distinct endpoints")
+
+    candidates = endpoints
+    if prefilter:
+        candidates = prefilter_phase(endpoints, prefilter_timeout, 'any')
+
+    total = len(candidates)
+    decided = 0
+
+    def progress(result):
+        nonlocal decided
+        if result.protocol == async_checker.DETECT_ORDER[-1]:
+            decided += 1
+            if decided % 1000 == 0:
+                print(f"  Classified {decided}/{total} endpoints...")
+        if on_result:
+            on_result(result)
+
+    started = time.monotonic()
+    listed_under = {}
+    for proto, proxies in planned.items():
+        for proxy in proxies:
+            listed_under.setdefault(proxy, set()).add(proto)
+    results = async_checker.detect_protocols(candidates, timeout=timeout, concurrency=concurrency,
+                                             on_result=progress, adaptive=adaptive,
+                                             deadline=deadline, judges=judges, listed=listed_under)
+
+    working = {r.proxy for r in results if r.ok}
+    outcomes = {}
+    for proto in PROTOCOLS:
+        mine = listed.get(proto, set())
+        proto_results = [r for r in results if r.protocol == proto and (r.ok or r.proxy in mine)]
+        found = sum(1 for r in proto_results if r.ok and r.proxy not in mine)
+        mislabeled = sum(1 for r in proto_results if not r.ok and r.proxy in working)
+        if proto_results or proto in planned:
+            print(f"  {proto}: {sum(1 for r in proto_results if r.ok)} working, "
+                  f"{found} found beyond the {proto} list, {mislabeled} listed but speak another protocol")
+        record_check_metrics(proto, proto_results, started)
+        outcomes[proto] = (proto_results,
+                           prefilter_dropped(planned.get(proto, []), candidates, proto))
+    return outcomes
+
+def shard_of(proxy, count):
+    """Stable 1-based shard index of an endpoint, identical on every machine."""
+    return zlib.crc32(proxy.encode()) % count + 1
+
+def shard_file(proto, shard):
+    index, count = shard
+    return os.path.join(SHARDS_DIR, f"shard-{index}-of-{count}.{proto}.jsonl")
+
+def save_shard_results(proto, results, shard):
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    path = shard_file(proto, shard)
+    # Rewritten at every checkpoint, so a kill must not leave half a file
+    write_atomic(path, ''.join(json.dumps(r._asdict()) + '\n' for r in results).encode())
+    print(f"Saved {len(results)} {proto} results "
+          f"({sum(1 for r in results if r.ok)} working) to {path}")
+
+def merge_shards(history_path=HISTORY_FILE, fastest=FASTEST_TIER_SIZE, source_stats_path=None,
+                 ip_index_path=None):
+    """Combines every shard file in .state/shards/ into proxies/active/."""
+    print("\nMerging shard results...")
+    os.makedirs(ACTIVE_DIR, exist_ok=True)
+    results = {proto: [] for proto in PROTOCOLS}
+    seen_shards = {}
+    for name in sorted(os.listdir(SHARDS_DIR)) if os.path.isdir(SHARDS_DIR) else []:
+        match = re.fullmatch(r'shard-(\d+)-of-(\d+)\.(\w+)\.jsonl', name)
+        if not match or match.group(3) not in results:
+            continue
+        index, count, proto = int(match.group(1)), int(match.group(2)), match.group(3)
+        seen_shards.setdefault(count, set()).add(index)
+        with open(os.path.join(SHARDS_DIR, name), 'r') as f:
+            results[proto].extend(async_checker.ProbeResult(**json.loads(line)) for line in f if line.strip())
+
+    for count, indexes in seen_shards.items():
+        missing = sorted(set(range(1, count + 1)) - indexes)
+        if missing:
+            print(f"Warning: results of shards {missing} of {count} are missing")
+
+    history = ProxyHistory(history_path) if history_path else None
+    for proto in PROTOCOLS:
+        if history:
+            # In CI each shard planned against its own copy of the history,
+            # so rows for the listed proxies may not exist in this one yet
+            # and record() would lose their failures
+            clean_file = os.path.join(CLEAN_DIR, f"{proto}.txt")
+            if os.path.exists(clean_file):
+                history.touch(list(ProxySet.from_file(clean_file)), proto)
+            history.record(results[proto], proto)
+    save_active_lists(results, fastest, ip_index_path, history)
+    if source_stats_path:
+        record_source_yields(SourceScheduler(source_stats_path), results)
+    if history:
+        history.prune()
+        history.close()
+
+def check_shard(index, count, check_options, metrics_dir=None):
+    # Runs in a worker process: start from a clean registry, not the parent's
+    metrics.reset()
+    metrics.labels['shard'] = f"{index}/{count}"
+    try:
+        check_proxies_liveness(shard=(index, count), **check_options)
+    finally:
+        if metrics_dir:
+            metrics.write(metrics_dir, f"proxy_manager-shard-{index}-of-{count}")
+
+def check_with_local_shards(processes, check_options, metrics_dir=None):
+    """Runs one shard per process to use every local core, then merges them."""
+    shutil.rmtree(SHARDS_DIR, ignore_errors=True)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(check_shard, index, processes, check_options, metrics_dir)
+                   for index in range(1, processes + 1)]
+        for future in futures:
+            future.result()
+    merge_shards(check_options['history_path'], check_options['fastest'],
+                 check_options['source_stats_path'], check_options['ip_index_path'])
+
+class StreamingDeduper:
+    """
+    Source sink for streaming mode: forwards each (protocol, endpoint) to
+    the checker the first time any source reports it, skipping endpoints
+    the history says are still in backoff and those `blocklist` or the
+    per-protocol `suppressed` RangeFilters cover. Safe to call from fetch
+    threads.
+    """
+
+    def __init__(self, forward, known=None, now=None, blocklist=None, suppressed=None):
+        self.forward = forward
+        self.known = known
+        self.now = now or time.time()
+        self.blocklist = blocklist
+        self.suppressed = suppressed or {}
+        self.blocked = 0
+        self.suppressed_hits = {proto: 0 for proto in PROTOCOLS}
+        self.seen = {proto: set() for proto in PROTOCOLS}
+        self.lock = threading.Lock()
+        self.closed = False
+        self.forwarded = 0
+        self.duplicates = 0
+        self.skipped = 0
+
+    def __call__(self, protocol, proxy):
+        value = pack_endpoint(proxy)
+        if value is None or protocol not in self.seen:
+            return
+        with self.lock:
+            if self.closed:
+                return
+            if value in self.seen[protocol]:
+                self.duplicates += 1
+                return
+            self.seen[protocol].add(value)
+            if self.blocklist and self.blocklist.matches(value):
+                self.blocked += 1
+                return
+            if protocol in self.suppressed and self.suppressed[protocol].matches(value):
+                self.suppressed_hits[protocol] += 1
+                return
+            proxy = unpack_endpoint(value)
+            if self.known is not None and not is_due(self.known[protocol].get(proxy), self.now):
+                self.skipped += 1
+                return
+            self.forwarded += 1
+        self.forward(proxy, protocol)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+def run_streaming_pipeline(sources_list, fetch_budget=None, timeout=None, concurrency=None,
+                           history_path=HISTORY_FILE, fastest=FASTEST_TIER_SIZE,
+                           adaptive=True, phase_deadline=PHASE_DEADLINE, judges=None,
+                           scheduler=None, ip_index_path=None, blocklist=None, suppress=True):
+    """
+    Fetch, dedup and check as one overlapping pipeline: every endpoint a
+    source yields goes through StreamingDeduper straight into the async
+    checker while the other sources are still downloading. The per-source,
+    clean/ and active/ files are written at the end as in batch mode.
+    The TCP pre-filter is not used here; the async probe's own connect
+    already fails fast on dead hosts.
+    """
+    timeout = timeout or DEFAULT_TIMEOUTS['async']
+    concurrency = fit_concurrency(concurrency or DEFAULT_CONCURRENCY['async'], 'async')
+    history = ProxyHistory(history_path) if history_path else None
+    now = time.time()
+    known = {proto: history.load(proto) for proto in PROTOCOLS} if history else None
+    suppressed = ({proto: suppressed_subnets(rows) for proto, rows in known.items()}
+                  if known and suppress else None)
+
+    print(f"Streaming mode: Timeout={timeout}s, Concurrency={concurrency}")
+    started = time.monotonic()
+    completed = 0
+
+    def on_result(result):
+        nonlocal completed
+        completed += 1
+        if completed % 1000 == 0:
+            print(f"  Checked {completed} proxies so far...")
+
+    checker = async_checker.BackgroundChecker(
+        async_checker.AsyncLivenessChecker(timeout=timeout, concurrency=concurrency,
+                                           adaptive=adaptive, judges=judges),
+        on_result=on_result).start()
+    deduper = StreamingDeduper(checker.submit, known, now, blocklist, suppressed)
+    for _, source in sources_list:
+        source.sink = deduper
+
+    # 1. Fetch; checking runs concurrently as endpoints arrive
+    fetched = fetch_all_sources(sources_list, budget=fetch_budget, scheduler=scheduler)
+    source_sets = {}
+    by_name = dict(sources_list)
+    for name, proxies in fetched.items():
+        source_sets[name] = save_proxies_from_source(name, proxies, by_name[name].metadata)
+
+    # 2. Deduplicate; clean/ may also hold folders of sources not fetched
+    # this run, so feed whatever the stream has not seen yet
+    clean_sets = deduplicate_proxies(source_sets, scheduler, blocklist)
+    streamed, duplicates = deduper.forwarded, deduper.duplicates
+    for proto, clean in clean_sets.items():
+        for proxy in clean:
+            deduper(proto, proxy)
+    deduper.close()
+    print(f"Stream: forwarded {streamed} endpoints while fetching "
+          f"(+{deduper.forwarded - streamed} from older source folders), "
+          f"dropped {duplicates} duplicates, {deduper.skipped} in backoff, "
+          f"{deduper.blocked} blocklisted, {sum(deduper.suppressed_hits.values())} in suppressed subnets")
+    # Blocklisted endpoints are counted by deduplicate_proxies() already
+    for proto, count in deduper.suppressed_hits.items():
+        metrics.inc('proxy_blocklist_dropped_total', count, protocol=proto, kind='learned')
+
+    # 3. Wait for outstanding checks and save
+    print("\nWaiting for outstanding liveness checks...")
+    results = checker.finish(deadline=phase_deadline)
+    os.makedirs(ACTIVE_DIR, exist_ok=True)
+    by_proto = {}
+    for proto in PROTOCOLS:
+        proto_results = by_proto[proto] = [r for r in results if r.protocol == proto]
+        # Checks overlapped the fetch, so throughput is over the whole pipeline
+        record_check_metrics(proto, proto_results, started)
+        if history:
+            history.touch(list(clean_sets.get(proto, ())), proto, now)
+            history.record(proto_results, proto)
+    save_active_lists(by_proto, fastest, ip_index_path, history)
+
+    if scheduler:
+        record_source_yields(scheduler, by_proto)
+    if history:
+        history.prune()
+        history.close()
 
 def load_proxy_sources():
     source_instances = []
     # Iterate over all modules in the 'sources' package
     for _, name, _ in pkgutil.iter_modules(sources.__path__, sources.__name__ + "."):
-        if name.endswith('.base'): continue
+        if name.split('.')[-1] in SOURCE_HELPER_MODULES: continue
         
         try:
             module = importlib.import_module(name)
@@ -141,7 +1147,7 @@ def load_proxy_sources():
             for _, obj in inspect.getmembers(module):
                 if (inspect.isclass(obj) and 
                     issubclass(obj, ProxySource) and 
-                    obj is not ProxySource):
+                    obj.__module__ == module.__name__):
                     
                     source_name = name.split('.')[-1]
                     source_instances.append((source_name, obj()))
@@ -150,24 +1156,273 @@ def load_proxy_sources():
             print(f"Error loading module {name}: {e}")
     return source_instances
 
+def record_source_metrics(name, status, proxies, started, elapsed, stats):
+    metrics.add_span('fetch', started, elapsed, source=name)
+    metrics.set('proxy_source_ok', int(status == 'ok'), source=name)
+    metrics.set('proxy_source_fetch_seconds', round(elapsed, 3), source=name)
+    metrics.set('proxy_source_requests_total', stats['requests'], source=name)
+    metrics.set('proxy_source_bytes_total', stats['bytes'], source=name)
+    metrics.set('proxy_source_parse_seconds', round(stats['parse_seconds'], 3), source=name)
+    metrics.set('proxy_source_cache_hits_total', stats['hits'], source=name)
+    for proto, entries in proxies.items():
+        metrics.set('proxy_source_proxies', len(entries), source=name, protocol=proto)
+
+def schedule_sources(sources_list, scheduler, fetch_all=False):
+    """The sources to fetch this run according to `scheduler`; all of them with `fetch_all`."""
+    due, skipped = (sources_list, []) if fetch_all else scheduler.select(sources_list)
+    for name, _ in sources_list:
+        metrics.set('proxy_source_scheduled', int(name not in dict(skipped)), source=name)
+    if skipped:
+        print(f"Schedule: fetching {len(due)} sources, skipping {len(skipped)} "
+              f"(their previous lists are still used)")
+    return due
+
+def record_source_yields(scheduler, results):
+    """Credits every source with the working proxies among `results` it lists."""
+    active = {proto: ProxySet.from_lines(r.proxy for r in proto_results if r.ok)
+              for proto, proto_results in results.items()}
+    scheduler.record_yield(load_source_sets(), active)
+    scheduler.save()
+
+def fetch_all_sources(sources_list, budget=None, scheduler=None):
+    """
+    Runs every source's fetch() concurrently, each under its own wall-clock
+    budget. A source that overruns its budget (or raises) still contributes
+    whatever it collected so far. Fetch costs are recorded in `scheduler` if
+    given. Returns {source_name: proxies_dict}.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(sources_list), 1))
+    started = time.monotonic()
+    pending = {}
+    for name, source in sources_list:
+        print(f"Fetching from {name}...")
+        source.start_budget(budget)
+        pending[executor.submit(source.fetch)] = (name, source)
+
+    fetched = {}
+    timings = []
+    while pending:
+        next_deadline = min(source.deadline for _, source in pending.values())
+        done, _ = concurrent.futures.wait(
+            pending, timeout=max(next_deadline - time.monotonic(), 0),
+            return_when=concurrent.futures.FIRST_COMPLETED)
+
+        for future in list(pending):
+            name, source = pending[future]
+            if future in done:
+                try:
+                    fetched[name] = future.result()
+                    status = 'ok'
+                except Exception as e:
+                    print(f"Error running {name}: {e}")
+                    fetched[name] = source.snapshot()
+                    status = 'error'
+            elif source.out_of_time():
+                print(f"  {name} ran out of its fetch budget, keeping partial results")
+                fetched[name] = source.snapshot()
+                status = 'timeout'
+            else:
+                continue
+            del pending[future]
+            count = sum(len(v) for v in fetched[name].values())
+            elapsed = time.monotonic() - started
+            timings.append((name, status, count, elapsed, source.stats))
+            record_source_metrics(name, status, fetched[name], started, elapsed, source.stats)
+            if scheduler:
+                scheduler.record_fetch(name, status, elapsed, source.stats['requests'], count)
+
+    # Overrunning fetches stop by themselves once out_of_time() flips
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    print("\nFetch summary:")
+    for name, status, count, elapsed, cache in timings:
+        print(f"  {name:<15} {status:<8} {count:>7} proxies  {elapsed:6.1f}s  "
+              f"cache {cache['hits']} hit / {cache['misses']} miss")
+    print(f"  Fetch phase took {time.monotonic() - started:.1f}s")
+    return fetched
+
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must look like K/N, e.g. 3/8")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("shard index must be between 1 and N")
+    return index, count
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch, deduplicate and check free proxies.")
+    parser.add_argument('--engine', choices=ENGINES, default='async',
+                        help="liveness checker to use (default: async)")
+    parser.add_argument('--timeout', type=float,
+                        help="per-proxy check timeout in seconds (default depends on engine)")
+    parser.add_argument('--fixed-timeout', dest='adaptive', action='store_false',
+                        help="always use --timeout instead of adapting it to observed latency")
+    parser.add_argument('--phase-deadline', type=float, default=PHASE_DEADLINE,
+                        help=f"hard limit in seconds per protocol check phase (default: {PHASE_DEADLINE})")
+    parser.add_argument('--concurrency', type=int,
+                        help="max checks in flight (default depends on engine)")
+    parser.add_argument('--no-prefilter', dest='prefilter', action='store_false',
+                        help="skip the TCP connect pre-filter before the full checks")
+    parser.add_argument('--prefilter-timeout', type=float, default=PREFILTER_TIMEOUT,
+                        help=f"TCP connect timeout of the pre-filter (default: {PREFILTER_TIMEOUT}s)")
+    parser.add_argument('--history', default=HISTORY_FILE,
+                        help="SQLite file with per-proxy check history (default: .state/history.sqlite)")
+    parser.add_argument('--no-history', dest='history', action='store_const', const=None,
+                        help="check every proxy without consulting or updating the history")
+    parser.add_argument('--source-stats', default=SOURCE_STATS_FILE,
+                        help="JSON file with per-source fetch cost and yield used to schedule "
+                             "fetches (default: .state/sources.json)")
+    parser.add_argument('--no-source-stats', dest='source_stats', action='store_const', const=None,
+                        help="fetch every source without consulting or updating the source stats")
+    parser.add_argument('--all-sources', action='store_true',
+                        help="fetch every source this run, even those the schedule would skip")
+    parser.add_argument('--blocklist', default=BLOCKLIST_FILE,
+                        help="CIDR/port rules for endpoints dropped during deduplication "
+                             "(default: .scripts/blocklist.txt)")
+    parser.add_argument('--no-blocklist', dest='blocklist', action='store_const', const=None,
+                        help="keep every endpoint the sources list")
+    parser.add_argument('--no-suppress', dest='suppress', action='store_false',
+                        help="also check subnets the history says never validate")
+    parser.add_argument('--journal-dir', default=JOURNAL_DIR,
+                        help="where check runs journal their results so a killed run can resume "
+                             "(default: .state/journal)")
+    parser.add_argument('--no-journal', dest='journal_dir', action='store_const', const=None,
+                        help="do not journal results; a killed run starts over")
+    parser.add_argument('--ip-index', default=IP_INDEX_FILE,
+                        help="compiled IP range index (see iprange.py) for the country/ASN of "
+                             "working proxies; without it only source-reported metadata is used "
+                             "(default: .state/ipranges.idx)")
+    parser.add_argument('--fetch-budget', type=float,
+                        help="wall-clock seconds each source may spend fetching (default: per source)")
+    parser.add_argument('--check-only', action='store_true',
+                        help="skip fetching and deduplication, only re-check proxies/clean/")
+    parser.add_argument('--fastest', type=int, default=FASTEST_TIER_SIZE,
+                        help=f"proxies per protocol in proxies/fastest/ (default: {FASTEST_TIER_SIZE}, 0 disables)")
+    parser.add_argument('--fetch-only', action='store_true',
+                        help="fetch and deduplicate, but do not check liveness")
+    parser.add_argument('--shard', type=parse_shard, metavar='K/N',
+                        help="only check shard K of N of proxies/clean/ and write .state/shards/ results")
+    parser.add_argument('--merge-shards', action='store_true',
+                        help="combine .state/shards/ results into proxies/active/ and exit")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="check with this many local shard processes (default: 1)")
+    parser.add_argument('--stream', action='store_true',
+                        help="check proxies while sources are still fetching (async engine only)")
+    parser.add_argument('--detect', action='store_true',
+                        help="probe each endpoint once across all protocol lists and file it under "
+                             "the protocols it actually speaks (async engine only)")
+    parser.add_argument('--metrics-dir', default=METRICS_DIR,
+                        help="where to write the JSON run report and Prometheus textfile "
+                             "(default: .state/metrics)")
+    parser.add_argument('--judge', action='append', dest='judges', metavar='URL',
+                        help="judge URL to probe through, repeatable; e.g. a self-hosted "
+                             "`python judge.py` (default: public judges)")
+    args = parser.parse_args()
+    for url in args.judges or []:
+        try:
+            judge.Judge(url)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.judges and args.engine == 'async' and not any(u.startswith('http://') for u in args.judges):
+        parser.error("the async engine needs at least one http:// --judge")
+    if args.stream and args.engine != 'async':
+        parser.error("--stream requires --engine async")
+    if args.stream and (args.shard or args.processes > 1):
+        parser.error("--stream cannot be combined with sharding")
+    if args.detect and (args.engine != 'async' or args.stream):
+        parser.error("--detect requires --engine async and cannot be combined with --stream")
+    return args
+
+def check_liveness(processes, check_options, metrics_dir=None):
+    if processes > 1:
+        check_with_local_shards(processes, check_options, metrics_dir)
+    else:
+        check_proxies_liveness(**check_options)
+
 def main():
+    args = parse_args()
+    raise_fd_limit()
+    report_name = 'proxy_manager'
+    if args.shard:
+        report_name += f"-shard-{args.shard[0]}-of-{args.shard[1]}"
+        metrics.labels['shard'] = f"{args.shard[0]}/{args.shard[1]}"
+    elif args.merge_shards:
+        report_name += '-merge'
+    elif args.fetch_only:
+        report_name += '-fetch'
+    try:
+        run(args)
+    finally:
+        # Written for failed runs too, so a missing or stale report is alertable
+        path = metrics.write(args.metrics_dir, report_name)
+        print(f"Run report written to {path}")
+
+def run(args):
+    check_options = {
+        'engine': args.engine,
+        'timeout': args.timeout,
+        'concurrency': args.concurrency,
+        'prefilter': args.prefilter,
+        'prefilter_timeout': args.prefilter_timeout,
+        'history_path': args.history,
+        'fastest': args.fastest,
+        'adaptive': args.adaptive,
+        'phase_deadline': args.phase_deadline,
+        'judges': args.judges,
+        'detect': args.detect,
+        'source_stats_path': args.source_stats,
+        'ip_index_path': args.ip_index,
+        'suppress': args.suppress,
+        'journal_dir': args.journal_dir,
+    }
+
+    if args.merge_shards:
+        merge_shards(args.history, args.fastest, args.source_stats, args.ip_index)
+        return
+
+    if args.shard:
+        check_proxies_liveness(shard=args.shard, **check_options)
+        return
+
+    if args.check_only:
+        check_liveness(args.processes, check_options, args.metrics_dir)
+        return
+
     # 1. Fetch from all sources
     sources_list = load_proxy_sources()
     print(f"Loaded {len(sources_list)} sources: {[n for n, _ in sources_list]}")
+    scheduler = SourceScheduler(args.source_stats) if args.source_stats else None
+    blocklist = load_blocklist(args.blocklist) if args.blocklist else None
+    if scheduler:
+        sources_list = schedule_sources(sources_list, scheduler, args.all_sources)
+
+    if args.stream:
+        run_streaming_pipeline(sources_list, fetch_budget=args.fetch_budget,
+                               timeout=args.timeout, concurrency=args.concurrency,
+                               history_path=args.history, fastest=args.fastest,
+                               adaptive=args.adaptive, phase_deadline=args.phase_deadline,
+                               judges=args.judges, scheduler=scheduler,
+                               ip_index_path=args.ip_index, blocklist=blocklist,
+                               suppress=args.suppress)
+        return
+
+    fetched = fetch_all_sources(sources_list, budget=args.fetch_budget, scheduler=scheduler)
+    source_sets = {}
+    by_name = dict(sources_list)
+    for name, proxies in fetched.items():
+        source_sets[name] = save_proxies_from_source(name, proxies, by_name[name].metadata)
 
-    for name, source in sources_list:
-        print(f"Fetching from {name}...")
-        try:
-            proxies = source.fetch()
-            save_proxies_from_source(name, proxies)
-        except Exception as e:
-            print(f"Error running {name}: {e}")
-            
     # 2. Deduplicate
-    deduplicate_proxies()
-    
+    deduplicate_proxies(source_sets, scheduler, blocklist)
+    if scheduler:
+        scheduler.save()
+
+    if args.fetch_only:
+        return
+
     # 3. Check
-    check_proxies_liveness()
+    check_liveness(args.processes, check_options, args.metrics_dir)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,158 @@
+import array
+import heapq
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def pack_endpoint(proxy):
+    """Packs 'a.b.c.d:port' into one integer (ip << 16 | port), or None if invalid."""
+    host, sep, port = proxy.strip().rpartition(':')
+    if not sep:
+        return None
+    parts = host.split('.')
+    if len(parts) != 4:
+        return None
+    try:
+        octets = [int(p) for p in parts]
+        port = int(port)
+    except ValueError:
+        return None
+    if not 0 < port < 65536 or any(not 0 <= o <= 255 for o in octets):
+        return None
+    ip = (octets[0] << 24) | (octets[1] << 16) | (octets[2] << 8) | octets[3]
+    return (ip << 16) | port
+
+
+def unpack_endpoint(value):
+    ip = value >> 16
+    return f"{ip >> 24}.{(ip >> 16) & 255}.{(ip >> 8) & 255}.{ip & 255}:{value & 0xFFFF}"
+
+
+def sorted_unique(values):
+    """Sorts and compacts packed endpoints into a new array('Q')."""
+    if np is not None:
+        return array.array('Q', np.unique(np.asarray(values, dtype=np.uint64)).tobytes())
+    out = array.array('Q')
+    last = None
+    for value in sorted(values):
+        if value != last:
+            out.append(value)
+            last = value
+    return out
+
+
+class ProxySet:
+    """
+    Immutable set of IPv4 endpoints stored as a sorted array of packed
+    (ip << 16 | port) integers, 8 bytes per entry instead of a Python str.
+    Union/difference/intersection are merge walks over the sorted arrays
+    (or NumPy set routines when NumPy is installed).
+    """
+
+    __slots__ = ('values', 'rejected')
+
+    def __init__(self, values=None, rejected=0):
+        # `values` must already be sorted and unique
+        self.values = values if values is not None else array.array('Q')
+        self.rejected = rejected
+
+    @classmethod
+    def from_packed(cls, values):
+        return cls(sorted_unique(values))
+
+    @classmethod
+    def from_lines(cls, lines):
+        packed = array.array('Q')
+        rejected = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            value = pack_endpoint(line)
+            if value is None:
+                rejected += 1
+            else:
+                packed.append(value)
+        return cls(sorted_unique(packed), rejected)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'r') as f:
+            return cls.from_lines(f)
+
+    @classmethod
+    def union_all(cls, sets):
+        sets = [s for s in sets if s]
+        if not sets:
+            return cls()
+        if np is not None:
+            merged = np.concatenate([np.frombuffer(s.values, dtype=np.uint64) for s in sets])
+            return cls(sorted_unique(merged))
+        out = array.array('Q')
+        last = None
+        for value in heapq.merge(*(s.values for s in sets)):
+            if value != last:
+                out.append(value)
+                last = value
+        return cls(out)
+
+    def union(self, *others):
+        return ProxySet.union_all((self,) + others)
+
+    def difference(self, other):
+        if np is not None:
+            a = np.frombuffer(self.values, dtype=np.uint64)
+            b = np.frombuffer(other.values, dtype=np.uint64)
+            return ProxySet(array.array('Q', np.setdiff1d(a, b, assume_unique=True).tobytes()))
+        out = array.array('Q')
+        theirs = other.values
+        j, n = 0, len(theirs)
+        for value in self.values:
+            while j < n and theirs[j] < value:
+                j += 1
+            if j == n or theirs[j] != value:
+                out.append(value)
+        return ProxySet(out)
+
+    def intersection(self, other):
+        if np is not None:
+            a = np.frombuffer(self.values, dtype=np.uint64)
+            b = np.frombuffer(other.values, dtype=np.uint64)
+            return ProxySet(array.array('Q', np.intersect1d(a, b, assume_unique=True).tobytes()))
+        out = array.array('Q')
+        theirs = other.values
+        j, n = 0, len(theirs)
+        for value in self.values:
+            while j < n and theirs[j] < value:
+                j += 1
+            if j < n and theirs[j] == value:
+                out.append(value)
+        return ProxySet(out)
+
+    def __contains__(self, proxy):
+        value = pack_endpoint(proxy) if isinstance(proxy, str) else proxy
+        if value is None:
+            return False
+        lo, hi = 0, len(self.values)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.values[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < len(self.values) and self.values[lo] == value
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return self.to_lines()
+
+    def to_lines(self):
+        return (unpack_endpoint(v) for v in self.values)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write('\n'.join(self.to_lines()) + '\n')
@@ -0,0 +1,129 @@
+import json
+import os
+import time
+
+from manifest import write_atomic
+from proxyset import ProxySet
+
+# A fetch is productive when the check that follows finds at least
+# MIN_LIVE_UNIQUE working proxies that no other source lists. Productive
+# sources are fetched on every run; the others back off like failing proxies
+# in history.py: SOURCE_BACKOFF_BASE, doubling per unproductive fetch, never
+# longer than MAX_SOURCE_INTERVAL so every source is still refreshed
+# regularly. Sources never checked stay due on every run.
+MIN_LIVE_UNIQUE = 5
+SOURCE_BACKOFF_BASE = 5 * 3600
+MAX_SOURCE_INTERVAL = 2 * 24 * 3600
+
+# Skipping a fetch this cheap saves nothing, so such sources are always due
+CHEAP_FETCH_SECONDS = 5
+CHEAP_FETCH_REQUESTS = 3
+
+
+def backoff_interval(idle):
+    if idle <= 0:
+        return 0
+    return min(SOURCE_BACKOFF_BASE * 2 ** (idle - 1), MAX_SOURCE_INTERVAL)
+
+
+def count_unique(collected):
+    """
+    {source: {protocol: ProxySet}} -> {source: {protocol: ProxySet of the
+    entries no other source lists under that protocol}}.
+    """
+    unique = {}
+    for name, sets in collected.items():
+        unique[name] = {}
+        for proto, proxies in sets.items():
+            others = ProxySet.union_all(s.get(proto) for n, s in collected.items() if n != name)
+            unique[name][proto] = proxies.difference(others)
+    return unique
+
+
+class SourceScheduler:
+    """
+    Per-source fetch cost and yield kept in a small JSON file between runs,
+    used to decide which sources to fetch on a given run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sources = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.sources = json.load(f)
+
+    def stats(self, name):
+        return self.sources.setdefault(name, {
+            'last_fetched': None, 'fetch_seconds': None, 'requests': None,
+            'listed': None, 'unique': None, 'live': None, 'live_unique': None,
+            'idle': 0, 'pending': False,
+        })
+
+    def is_cheap(self, stats):
+        return (stats['fetch_seconds'] is not None
+                and stats['fetch_seconds'] <= CHEAP_FETCH_SECONDS
+                and (stats['requests'] or 0) <= CHEAP_FETCH_REQUESTS)
+
+    def next_fetch(self, name):
+        """Unix time from which `name` is due again; None means due now."""
+        stats = self.stats(name)
+        if stats['last_fetched'] is None or self.is_cheap(stats):
+            return None
+        return stats['last_fetched'] + backoff_interval(stats['idle'])
+
+    def select(self, sources_list, now=None):
+        """Splits [(name, source)] into (due, skipped) and prints why."""
+        now = now or time.time()
+        due, skipped = [], []
+        for name, source in sources_list:
+            next_fetch = self.next_fetch(name)
+            if next_fetch is None or next_fetch <= now:
+                due.append((name, source))
+            else:
+                skipped.append((name, source))
+                stats = self.stats(name)
+                print(f"  Skipping {name}: {stats['live_unique']} unique working proxies last time, "
+                      f"next fetch in {(next_fetch - now) / 3600:.1f}h")
+        return due, skipped
+
+    def record_fetch(self, name, status, seconds, requests, listed, now=None):
+        stats = self.stats(name)
+        stats['fetch_seconds'] = round(seconds, 2)
+        stats['requests'] = requests
+        if status == 'ok':
+            stats['last_fetched'] = round(now or time.time())
+            stats['listed'] = listed
+            stats['pending'] = True
+        else:
+            # Failed fetches are retried next run instead of backing off
+            stats['last_fetched'] = None
+
+    def record_overlap(self, collected):
+        for name, sets in count_unique(collected).items():
+            self.stats(name)['unique'] = sum(len(s) for s in sets.values())
+
+    def record_yield(self, collected, active):
+        """
+        Counts per source how many of `active` ({protocol: ProxySet}) it
+        lists, and how many of those only it lists, then updates the backoff
+        of the sources fetched since the last call.
+        """
+        for name, sets in count_unique(collected).items():
+            stats = self.stats(name)
+            stats['unique'] = sum(len(s) for s in sets.values())
+            stats['live'] = sum(len(collected[name][proto].intersection(active[proto]))
+                                for proto in collected[name] if proto in active)
+            stats['live_unique'] = sum(len(s.intersection(active[proto]))
+                                       for proto, s in sets.items() if proto in active)
+            if not stats['pending']:
+                continue
+            stats['pending'] = False
+            if stats['live_unique'] >= MIN_LIVE_UNIQUE:
+                stats['idle'] = 0
+            else:
+                stats['idle'] += 1
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_atomic(self.path, json.dumps(self.sources, indent=2, sort_keys=True).encode())
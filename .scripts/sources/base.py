@@ -1,8 +1,23 @@
+import time
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from .client import cached_get, record
 
 class ProxySource(ABC):
+    # Wall-clock seconds a fetch may take before the manager moves on with
+    # whatever has been collected so far. Override per source if needed.
+    budget = 120
+
     def __init__(self):
         self.proxies = {'http': [], 'socks4': [], 'socks5': []}
+        self.deadline = None
+        self.stats = {'hits': 0, 'misses': 0, 'requests': 0, 'bytes': 0, 'parse_seconds': 0.0}
+        # Optional callable(protocol, proxy) fed as proxies are found,
+        # used by the manager's streaming mode
+        self.sink = None
+        # {proxy: {'country': 'US', 'asn': 13335}} for sources whose API
+        # reports it; used where the offline IP index has no answer
+        self.metadata = {}
 
     @abstractmethod
     def fetch(self):
@@ -13,9 +28,51 @@ class ProxySource(ABC):
             'socks4': ['ip:port', ...],
             'socks5': ['ip:port', ...]
         }
+        Long-running fetches should stop once out_of_time() is True.
         """
         pass
 
     def add_proxy(self, protocol, proxy):
         if protocol in self.proxies:
             self.proxies[protocol].append(proxy)
+            if self.sink:
+                self.sink(protocol, proxy)
+
+    def add_proxies(self, protocol, proxies):
+        for proxy in proxies:
+            self.add_proxy(protocol, proxy)
+
+    def add_metadata(self, proxy, country=None, asn=None):
+        """Records what the source says about `proxy`; asn may be 13335 or 'AS13335'."""
+        try:
+            asn = int(str(asn).upper().removeprefix('AS')) if asn else None
+        except ValueError:
+            asn = None
+        # The code becomes a by-country/ folder name, so only two ASCII letters pass
+        valid = isinstance(country, str) and len(country) == 2 and country.isascii() and country.isalpha()
+        country = country.upper() if valid else None
+        if country or asn:
+            self.metadata[proxy] = {'country': country, 'asn': asn}
+
+    def get(self, url, params=None, timeout=20):
+        """GET through the shared pooled client with on-disk revalidation cache."""
+        return cached_get(url, params=params, timeout=timeout, stats=self.stats)
+
+    @contextmanager
+    def parsing(self):
+        """Wrap response parsing in this to have it reported as parse time."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            record(self.stats, parse_seconds=time.monotonic() - start)
+
+    def start_budget(self, budget=None):
+        self.deadline = time.monotonic() + (budget or self.budget)
+
+    def out_of_time(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def snapshot(self):
+        """Copy of the proxies collected so far, safe to take mid-fetch."""
+        return {protocol: list(proxies) for protocol, proxies in self.proxies.items()}
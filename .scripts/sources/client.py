@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CACHE_DIR = os.path.join(ROOT_DIR, ".state", "http_cache")
+
+POOL_SIZE = 16
+RETRIES = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(['GET']),
+    raise_on_status=False,
+)
+
+_session = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide keep-alive session shared by every source."""
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+                                  max_retries=RETRIES)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+    return _session
+
+
+class ResponseCache:
+    """
+    Bodies of responses that carried an ETag or Last-Modified header, stored
+    on disk so the next run can revalidate them with a conditional request.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+
+    def paths(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.json', base + '.body'
+
+    def load(self, url):
+        meta_path, body_path = self.paths(url)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None
+
+    def store(self, url, resp):
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path, body_path = self.paths(url)
+        meta = {
+            'url': url,
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+            'encoding': resp.encoding,
+        }
+        for path, data, mode in ((body_path, resp.content, 'wb'),
+                                 (meta_path, json.dumps(meta), 'w')):
+            tmp = path + '.tmp'
+            with open(tmp, mode) as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+
+cache = ResponseCache()
+
+
+def cached_get(url, params=None, timeout=20, stats=None):
+    """
+    GET through the shared session. A cached copy is revalidated with
+    If-None-Match / If-Modified-Since; on 304 the cached body is served as a
+    normal 200 response with `from_cache` set.
+    """
+    session = get_session()
+    full_url = requests.Request('GET', url, params=params).prepare().url
+
+    headers = {}
+    entry = cache.load(full_url)
+    if entry:
+        meta, _ = entry
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    resp = session.get(full_url, headers=headers, timeout=timeout)
+    resp.from_cache = False
+
+    if resp.status_code == 304 and entry:
+        meta, body = entry
+        resp.status_code = 200
+        resp._content = body
+        resp.encoding = meta.get('encoding')
+        resp.from_cache = True
+    elif resp.status_code == 200 and ('ETag' in resp.headers or 'Last-Modified' in resp.headers):
+        cache.store(full_url, resp)
+
+    if stats is not None:
+        record(stats, requests=1, bytes=len(resp.content),
+               **{'hits' if resp.from_cache else 'misses': 1})
+    return resp
+
+
+def record(stats, **deltas):
+    """Adds `deltas` to a source's stats dict; sources may fetch from several threads."""
+    with _lock:
+        for key, value in deltas.items():
+            stats[key] += value
@@ -0,0 +1,137 @@
+import collections
+import concurrent.futures
+import math
+from .base import ProxySource
+
+
+def protocols_from_names(value):
+    """Maps protocol names such as ['socks4', 'https'] to our protocol keys."""
+    protocols = []
+    for proto in value or []:
+        p_lower = str(proto).lower()
+        if 'socks4' in p_lower: protocols.append('socks4')
+        elif 'socks5' in p_lower: protocols.append('socks5')
+        elif 'http' in p_lower: protocols.append('http')
+    return protocols
+
+
+def dig(data, path):
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+class PaginatedJSONSource(ProxySource):
+    """
+    Base for APIs that return pages of JSON items with ip/port/protocol
+    fields. Subclasses only declare where things are; fetch() keeps up to
+    `prefetch` page requests in flight and stops at the first empty or
+    short page (or at the page count derived from `total_path`).
+    """
+
+    label = None
+    url = None
+    params = {}
+    page_param = 'page'
+    size_param = 'limit'
+    page_size = 500
+    first_page = 1
+    max_pages = 200
+
+    items_path = ('data',)
+    total_path = None
+    ip_key = 'ip'
+    port_key = 'port'
+    protocols_key = 'protocols'
+    # Item fields with the country code and AS number, if the API has them
+    country_key = None
+    asn_key = None
+
+    timeout = 20
+    prefetch = 8
+
+    def map_protocols(self, value):
+        return protocols_from_names(value)
+
+    def check_response(self, data):
+        """Raise here to reject a page the API answered with an error payload."""
+        pass
+
+    def fetch_page(self, page):
+        params = dict(self.params)
+        params[self.page_param] = page
+        params[self.size_param] = self.page_size
+
+        print(f"  Fetching {self.label} page {page}...")
+        resp = self.get(self.url, params=params, timeout=self.timeout)
+        resp.raise_for_status()
+        with self.parsing():
+            data = resp.json()
+        self.check_response(data)
+        return data
+
+    def parse_items(self, items):
+        with self.parsing():
+            for item in items:
+                ip = item.get(self.ip_key)
+                port = item.get(self.port_key)
+                if not ip or not port: continue
+
+                proxy = f"{ip}:{port}"
+                for protocol in self.map_protocols(item.get(self.protocols_key)):
+                    self.add_proxy(protocol, proxy)
+                if self.country_key or self.asn_key:
+                    self.add_metadata(proxy, item.get(self.country_key), item.get(self.asn_key))
+
+    def last_page(self, data):
+        if not self.total_path:
+            return None
+        try:
+            total = int(dig(data, self.total_path))
+        except (TypeError, ValueError):
+            return None
+        return self.first_page + max(math.ceil(total / self.page_size), 1) - 1
+
+    def fetch(self):
+        self.label = self.label or type(self).__name__
+        page_limit = self.first_page + self.max_pages - 1
+
+        try:
+            first = self.fetch_page(self.first_page)
+        except Exception as e:
+            print(f"Error fetching {self.label} page {self.first_page}: {e}")
+            return self.proxies
+
+        items = dig(first, self.items_path) or []
+        self.parse_items(items)
+        if len(items) < self.page_size:
+            return self.proxies
+        page_limit = min(page_limit, self.last_page(first) or page_limit)
+
+        next_page = self.first_page + 1
+        inflight = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+            while not self.out_of_time():
+                while len(inflight) < self.prefetch and next_page <= page_limit:
+                    inflight.append((next_page, executor.submit(self.fetch_page, next_page)))
+                    next_page += 1
+                if not inflight:
+                    break
+
+                page, future = inflight.popleft()
+                try:
+                    items = dig(future.result(), self.items_path) or []
+                except Exception as e:
+                    print(f"Error fetching {self.label} page {page}: {e}")
+                    break
+
+                self.parse_items(items)
+                if len(items) < self.page_size:
+                    break
+
+            for _, future in inflight:
+                future.cancel()
+
+        return self.proxies
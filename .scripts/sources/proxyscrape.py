@@ -1,4 +1,3 @@
-import requests
 from .base import ProxySource
 
 class ProxyScrape(ProxySource):
@@ -10,11 +9,14 @@ class ProxyScrape(ProxySource):
         ]
         
         for protocol, url in urls:
+            if self.out_of_time():
+                break
             try:
-                resp = requests.get(url, timeout=20)
+                resp = self.get(url, timeout=20)
                 if resp.status_code == 200:
-                    proxies = [p.strip() for p in resp.text.splitlines() if p.strip()]
-                    self.proxies[protocol].extend(proxies)
+                    with self.parsing():
+                        proxies = [p.strip() for p in resp.text.splitlines() if p.strip()]
+                        self.add_proxies(protocol, proxies)
             except Exception as e:
                 print(f"Error fetching ProxyScrape {protocol}: {e}")
                 
@@ -1,17 +1,12 @@
 import os
 
+from manifest import ListManifest
+
 # Define base paths relative to this script
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 PROXIES_DIR = os.path.join(BASE_DIR, 'proxies')
 README_PATH = os.path.join(BASE_DIR, 'README.md')
 
-def count_lines(filepath):
-    full_path = os.path.join(BASE_DIR, filepath)
-    if not os.path.exists(full_path):
-        return 0
-    with open(full_path, 'r') as f:
-        return sum(1 for line in f if line.strip())
-
 def read_file_content(filepath):
     full_path = os.path.join(BASE_DIR, filepath)
     if not os.path.exists(full_path):
@@ -20,13 +15,15 @@ def read_file_content(filepath):
         return f.read().strip()
 
 def update_readme():
-    active_http = count_lines('proxies/active/http.txt')
-    active_socks4 = count_lines('proxies/active/socks4.txt')
-    active_socks5 = count_lines('proxies/active/socks5.txt')
-    
-    clean_http = count_lines('proxies/clean/http.txt')
-    clean_socks4 = count_lines('proxies/clean/socks4.txt')
-    clean_socks5 = count_lines('proxies/clean/socks5.txt')
+    # Counts come from the manifest proxy_manager.py writes, not the lists
+    manifest = ListManifest(PROXIES_DIR)
+    active_http = manifest.count('active/http')
+    active_socks4 = manifest.count('active/socks4')
+    active_socks5 = manifest.count('active/socks5')
+
+    clean_http = manifest.count('clean/http')
+    clean_socks4 = manifest.count('clean/socks4')
+    clean_socks5 = manifest.count('clean/socks5')
 
     base_template = read_file_content('.scripts/sources/base.py')
     example_source = read_file_content('.scripts/sources/proxyscrape.py')
@@ -57,6 +54,26 @@ This project is designed for developers, researchers, and enthusiasts who need f
 | **SOCKS4** | {active_socks4} | {clean_socks4} | [📥 Download](proxies/active/socks4.txt) | [📥 Download](proxies/clean/socks4.txt) |
 | **SOCKS5** | {active_socks5} | {clean_socks5} | [📥 Download](proxies/active/socks5.txt) | [📥 Download](proxies/clean/socks5.txt) |
 
+Active lists are sorted fastest first; all other lists are sorted by address. Entry counts, hashes and per-run added/removed counts for every list are in [`proxies/manifest.json`](proxies/manifest.json). Per-proxy timings (connect, time-to-first-byte, total) are in `proxies/active/<protocol>.jsonl`, and the 100 fastest proxies per protocol are in [`proxies/fastest/`](proxies/fastest). Active proxies are also split by country and by network in `proxies/by-country/<CC>/` and `proxies/by-asn/AS<number>/`, using the offline [iptoasn.com](https://iptoasn.com) database.
+
+### Always-fresh local pool
+Free proxies often die within minutes, so list snapshots go stale quickly. `.scripts/pool_daemon.py` keeps an in-memory pool built from `proxies/active/`, rechecks every proxy before it expires, and serves them over a local HTTP API:
+
+```bash
+python .scripts/pool_daemon.py --port 8081
+curl 'http://127.0.0.1:8081/proxy?protocol=http&strategy=latency'   # or round-robin, lru
+curl -X POST 'http://127.0.0.1:8081/report?proxy=1.2.3.4:8080'      # evicts a proxy that failed you
+```
+
+### Binary lists
+[`proxies/active.bin`](proxies/active.bin) and [`proxies/clean.bin`](proxies/clean.bin) hold the same lists as fixed-width records (address, port, protocols, latency, last time seen working) with a per-protocol index, for clients that load hundreds of thousands of proxies at startup. `.scripts/binexport.py` memory-maps them without parsing:
+
+```python
+from binexport import ProxyExport
+with ProxyExport('proxies/active.bin') as export:
+    fast = export.proxies('socks5', max_latency_ms=500, limit=100)
+```
+
 ## 🤝 How to Contribute
 We welcome contributions! If you know a good source of free proxies, you can add it to the scraper.
 
@@ -82,7 +99,7 @@ We welcome contributions! If you know a good source of free proxies, you can add
 
 ## 🛠 How it works
 1.  **Fetch**: Scripts in `.scripts/sources/` scrape proxies from various public APIs and websites.
-2.  **Clean**: Duplicates are removed across all sources.
+2.  **Clean**: Duplicates are removed across all sources, and addresses that are never open proxies (CDN edges, reserved ranges; see `.scripts/blocklist.txt`) are dropped.
 3.  **Check**: Every proxy is tested against `httpbin.org` or similar services to ensure it's alive.
 4.  **Deploy**: Results are pushed to this repo automatically.
 